@@ -0,0 +1,39 @@
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+
+def run_in_thread(sync_view, request, *args, **kwargs):
+    """Выполняет представление DRF целиком, включая рендеринг, и
+    закрывает соединения с базой этого потока."""
+    try:
+        response = sync_view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+    finally:
+        connections.close_all()
+
+
+def threaded_view(sync_view):
+    """Асинхронная обёртка синхронного представления DRF для ASGI.
+
+    Аутентификация, права, троттлинг, согласование формата, кэш ответов
+    и сериализация остаются в представлении DRF. Django по умолчанию
+    выполняет синхронные представления в одном общем потоке, поэтому
+    запросы процесса шли бы строго по очереди; здесь каждый запрос
+    занимает свой поток из пула asgiref, а соединение с базой
+    закрывается (возвращается в пул psycopg) в конце запроса.
+    """
+    async_view = sync_to_async(functools.partial(run_in_thread, sync_view),
+                               thread_sensitive=False)
+
+    async def view(request, *args, **kwargs):
+        return await async_view(request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    view.cls = sync_view.cls
+    view.initkwargs = sync_view.initkwargs
+    view.actions = getattr(sync_view, 'actions', None)
+    return view
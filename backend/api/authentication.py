@@ -0,0 +1,28 @@
+import copy
+import functools
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .invalidation import LocalCache
+
+TOKENS = LocalCache('tokens', settings.TOKEN_CACHE_TIMEOUT)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе для уже встречавшихся
+    токенов. Удаление токена (выход) и изменение пользователя
+    сбрасывают запись во всех процессах; без работающей шины сброса
+    кэш не используется (см. LocalCache)."""
+
+    def authenticate_credentials(self, key):
+        user, token = TOKENS.get_or_set(key, functools.partial(
+            super().authenticate_credentials, key))
+        if not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        # Запрос может изменить пользователя, общий объект не отдаём.
+        user, token = copy.copy(user), copy.copy(token)
+        token.user = user
+        return user, token
@@ -0,0 +1,249 @@
+import functools
+import hashlib
+import http
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from foodgram.metrics import CACHE_REQUESTS
+from .invalidation import InvalidationBus
+
+GENERATION_KEY = 'recipe-representation:generation'
+REPRESENTATIONS = 'recipe-representations'
+RESPONSE_GENERATION_KEY = 'anonymous-response:generation'
+RESPONSES = 'anonymous-responses'
+# Как часто ожидающий запрос проверяет, готов ли ответ.
+RESPONSE_POLL_INTERVAL = 0.02
+# Кэш в памяти процесса на остальных воркерах сбрасывается через
+# InvalidationBus; общий кэш достаточно сбросить один раз.
+PROCESS_LOCAL = isinstance(caches['default'], LocMemCache)
+
+
+def usable():
+    """Кэш в памяти процесса используется, только пока слушатель
+    InvalidationBus подписан на канал: иначе запись в другом воркере
+    его не сбросит (см. LocalCache)."""
+    InvalidationBus.listen()
+    return not PROCESS_LOCAL or InvalidationBus.listening()
+
+
+class RecipeRepresentationCache:
+    """Кэш не зависящей от пользователя части представления рецепта.
+
+    Изменение тегов или ингредиентов справочника затрагивает множество
+    рецептов, поэтому вместо удаления ключей увеличивается поколение,
+    входящее в ключ. Сброс отдельного рецепта увеличивает его версию:
+    представление, построенное из строк, прочитанных до сброса,
+    в кэш не попадёт. С кэшем в памяти процесса см. usable().
+    """
+
+    @staticmethod
+    def generation():
+        return cache.get_or_set(GENERATION_KEY, 1, None)
+
+    @staticmethod
+    def version_key(recipe_id):
+        return f'recipe-representation:version:{recipe_id}'
+
+    @classmethod
+    def tokens(cls, recipe_ids):
+        """Поколение и версии рецептов; читаются до построения."""
+        generation = cls.generation()
+        keys = {cls.version_key(recipe_id): recipe_id
+                for recipe_id in recipe_ids}
+        versions = cache.get_many(keys)
+        return {recipe_id: (generation, versions.get(key, 0))
+                for key, recipe_id in keys.items()}
+
+    @staticmethod
+    def key(token, recipe_id):
+        generation, version = token
+        return f'recipe-representation:{generation}:{recipe_id}:{version}'
+
+    @classmethod
+    def get_many(cls, recipe_ids):
+        """Найденные представления и токены всех рецептов для set()."""
+        if not usable():
+            return {}, dict.fromkeys(recipe_ids)
+        tokens = cls.tokens(recipe_ids)
+        keys = {cls.key(token, recipe_id): recipe_id
+                for recipe_id, token in tokens.items()}
+        found = cache.get_many(keys)
+        CACHE_REQUESTS.labels('recipe', 'hit').inc(len(found))
+        CACHE_REQUESTS.labels('recipe', 'miss').inc(len(keys) - len(found))
+        return {keys[key]: value for key, value in found.items()}, tokens
+
+    @classmethod
+    def set(cls, recipe_id, data, token):
+        """Сохраняет представление, если рецепт не сбрасывался после
+        get_many(), вернувшего token."""
+        if token is None or cls.tokens([recipe_id])[recipe_id] != token:
+            return
+        cache.set(cls.key(token, recipe_id), data,
+                  settings.RECIPE_CACHE_TIMEOUT)
+
+    @staticmethod
+    def invalidate(recipe_ids):
+        InvalidationBus.publish(REPRESENTATIONS, recipe_ids)
+
+    @staticmethod
+    def invalidate_all():
+        InvalidationBus.publish(REPRESENTATIONS)
+
+    @classmethod
+    def evict(cls, recipe_ids):
+        if recipe_ids is not None:
+            cache.delete_many([cls.key(token, recipe_id) for recipe_id, token
+                               in cls.tokens(recipe_ids).items()])
+            for recipe_id in recipe_ids:
+                key = cls.version_key(recipe_id)
+                cache.add(key, 0, None)
+                cache.incr(key)
+            return
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.set(GENERATION_KEY, 2, None)
+
+
+class AnonymousResponseCache:
+    """Готовые ответы на GET анонимных пользователей.
+
+    У анонима флаги в представлении рецепта всегда False, поэтому ответ
+    зависит только от адреса и формата. Ключ содержит поколение, которое
+    увеличивается при любом изменении рецептов, тегов или ингредиентов.
+    При промахе в общем кэше ответ строит один запрос, взявший
+    блокировку; остальные ждут его до RESPONSE_CACHE_WAIT секунд, а потом
+    строят ответ сами. Блокировка в памяти процесса не остановила бы
+    другие воркеры, поэтому с LocMemCache каждый запрос при промахе
+    строит ответ сразу, не занимая поток ожиданием, а сам кэш работает,
+    только пока слушатель InvalidationBus подписан на канал.
+    """
+
+    @staticmethod
+    def applies(request):
+        return (request.method in ('GET', 'HEAD')
+                and 'HTTP_AUTHORIZATION' not in request.META
+                and settings.RESPONSE_CACHE_TIMEOUT > 0
+                and usable())
+
+    @staticmethod
+    def generation():
+        return cache.get_or_set(RESPONSE_GENERATION_KEY, 1, None)
+
+    @classmethod
+    def key(cls, request, media_type):
+        # Порядок параметров не меняет ответ.
+        params = sorted((name, sorted(values))
+                        for name, values in request.GET.lists())
+        digest = hashlib.md5(
+            repr((request.scheme, request.get_host(), request.path,
+                  media_type, params)).encode(),
+            usedforsecurity=False).hexdigest()
+        return f'anonymous-response:{cls.generation()}:{digest}'
+
+    @staticmethod
+    def lookup(key):
+        """Запись кэша или None; при None второй элемент говорит,
+        строит ли ответ этот запрос."""
+        if PROCESS_LOCAL:
+            entry = cache.get(key)
+            CACHE_REQUESTS.labels(
+                'response', 'miss' if entry is None else 'hit').inc()
+            return entry, entry is None
+        deadline = time.monotonic() + settings.RESPONSE_CACHE_WAIT
+        while True:
+            entry = cache.get(key)
+            if entry is not None:
+                CACHE_REQUESTS.labels('response', 'hit').inc()
+                return entry, False
+            if cache.add(f'{key}:lock', True,
+                         math.ceil(settings.RESPONSE_CACHE_WAIT)):
+                CACHE_REQUESTS.labels('response', 'miss').inc()
+                return None, True
+            if time.monotonic() >= deadline:
+                CACHE_REQUESTS.labels('response', 'miss').inc()
+                return None, False
+            time.sleep(RESPONSE_POLL_INTERVAL)
+
+    @staticmethod
+    def store(key, response):
+        """Сохраняет готовый ответ 200 и снимает блокировку ключа."""
+        if response.status_code == http.HTTPStatus.OK:
+            if settings.RESPONSE_MICROCACHE_SECONDS > 0:
+                # nginx кэширует ответ на этот срок (proxy_cache).
+                response['X-Accel-Expires'] = str(
+                    settings.RESPONSE_MICROCACHE_SECONDS)
+            cache.set(key, {'content': response.content,
+                            'headers': dict(response.items())},
+                      settings.RESPONSE_CACHE_TIMEOUT)
+        AnonymousResponseCache.release(key)
+
+    @staticmethod
+    def release(key):
+        cache.delete(f'{key}:lock')
+
+    @staticmethod
+    def respond(request, entry):
+        """Ответ из записи кэша или 304 по её ETag и Last-Modified."""
+        headers = entry['headers']
+        response = get_conditional_response(
+            request, etag=headers.get('ETag'),
+            last_modified=parse_http_date_safe(
+                headers.get('Last-Modified')))
+        if response is None:
+            return HttpResponse(entry['content'], headers=headers)
+        for name, value in headers.items():
+            if name != 'Content-Type':
+                response[name] = value
+        return response
+
+    @classmethod
+    def cached(cls, method):
+        """Декоратор list и retrieve представлений DRF."""
+        @functools.wraps(method)
+        def view(self, request, *args, **kwargs):
+            if not cls.applies(request) or request.user.is_authenticated:
+                return method(self, request, *args, **kwargs)
+            key = cls.key(request, request.accepted_media_type)
+            entry, building = cls.lookup(key)
+            if entry is not None:
+                return cls.respond(request, entry)
+            if not building:
+                return method(self, request, *args, **kwargs)
+            try:
+                response = method(self, request, *args, **kwargs)
+            except Exception:
+                cls.release(key)
+                raise
+            if hasattr(response, 'add_post_render_callback'):
+                # Содержимое ответа DRF появляется после рендеринга.
+                response.add_post_render_callback(
+                    lambda rendered: cls.store(key, rendered))
+            else:
+                cls.store(key, response)
+            return response
+        return view
+
+    @staticmethod
+    def invalidate_all():
+        InvalidationBus.publish(RESPONSES)
+
+    @staticmethod
+    def evict(keys=None):
+        try:
+            cache.incr(RESPONSE_GENERATION_KEY)
+        except ValueError:
+            cache.set(RESPONSE_GENERATION_KEY, 2, None)
+
+
+InvalidationBus.register(REPRESENTATIONS, RecipeRepresentationCache.evict,
+                         remote=PROCESS_LOCAL)
+InvalidationBus.register(RESPONSES, AnonymousResponseCache.evict,
+                         remote=PROCESS_LOCAL)
@@ -0,0 +1,149 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from recipes.models import ChangeLogEntry, Ingredient, Recipe, Tag
+from .read_serializers import (IngredientReadSerializer,
+                               RecipeReadSerializer, TagReadSerializer)
+from .transactions import OnCommitBuffer
+
+COLLECTIONS = {
+    ChangeLogEntry.FAVORITE: 'favorites',
+    ChangeLogEntry.SHOPPING_CART: 'shopping_cart',
+    ChangeLogEntry.SUBSCRIPTION: 'subscriptions',
+}
+# Справочники, которые клиент обновляет внутри сохранённых рецептов.
+CATALOGS = {
+    ChangeLogEntry.TAG: ('tags', Tag, TagReadSerializer),
+    ChangeLogEntry.INGREDIENT: ('ingredients', Ingredient,
+                                IngredientReadSerializer),
+}
+
+
+class SyncResetRequired(Exception):
+    """Курсор старше сжатой части журнала: нужна полная загрузка."""
+
+
+class ChangeLog:
+    """Журнал изменений и сборка ответа синхронизации.
+
+    Записи одной транзакции копятся и пишутся после её фиксации, по
+    одной на объект: создание рецепта с ингредиентами и тегами даёт
+    одну запись, а не по записи на каждый сигнал.
+
+    Курсор — id записи, но id выдаются при вставке, а видны записи
+    после фиксации, поэтому запись с меньшим id может появиться позже
+    большей. Записи моложе SYNC_SAFETY_LAG секунд и всё после них
+    клиенту не отдаются, пока не станут старше.
+    """
+
+    @staticmethod
+    def record(kind, object_ids, user_id=None, deleted=False):
+        ChangeLog.pending.add({(kind, object_id, user_id): deleted
+                               for object_id in object_ids})
+
+    @staticmethod
+    def write(pending):
+        entries = [
+            ChangeLogEntry(kind=kind, object_id=object_id, user_id=user_id,
+                           deleted=deleted)
+            for (kind, object_id, user_id), deleted in pending.items()
+        ]
+        if len(entries) == 1:
+            # bulk_create открыл бы транзакцию ради одной строки.
+            entries[0].save()
+        elif entries:
+            ChangeLogEntry.objects.bulk_create(entries)
+
+    pending = OnCommitBuffer(write)
+
+    @staticmethod
+    def unsettled(entries):
+        """Id первой записи, которая ещё может обогнать незафиксированные
+        записи с меньшим id, или None."""
+        horizon = timezone.now() - timedelta(
+            seconds=settings.SYNC_SAFETY_LAG)
+        return entries.filter(created_at__gt=horizon).aggregate(
+            first=Min('id'))['first']
+
+    @classmethod
+    def latest_cursor(cls):
+        unsettled = cls.unsettled(ChangeLogEntry.objects)
+        if unsettled is not None:
+            return unsettled - 1
+        return ChangeLogEntry.objects.aggregate(
+            latest=Max('id'))['latest'] or 0
+
+    @classmethod
+    def changes(cls, since, user, request):
+        """Сжатые изменения после курсора since, видимые пользователю:
+        для каждого объекта учитывается только последняя запись.
+
+        Изменённые теги и ингредиенты приходят отдельно, без рецептов,
+        в которые они входят."""
+        if ChangeLogEntry.objects.filter(kind=ChangeLogEntry.RESET,
+                                         object_id__gt=since).exists():
+            raise SyncResetRequired
+        visible = Q(user=None)
+        if user.is_authenticated:
+            visible |= Q(user=user)
+        candidates = ChangeLogEntry.objects.filter(visible, id__gt=since)
+        unsettled = cls.unsettled(candidates)
+        if unsettled is not None:
+            candidates = candidates.filter(id__lt=unsettled)
+        entries = list(
+            candidates.exclude(kind=ChangeLogEntry.RESET).order_by('id')
+            .values_list('id', 'kind', 'object_id', 'deleted')
+            [:settings.SYNC_PAGE_SIZE + 1])
+        has_more = len(entries) > settings.SYNC_PAGE_SIZE
+        entries = entries[:settings.SYNC_PAGE_SIZE]
+
+        latest = {}
+        for _, kind, object_id, deleted in entries:
+            latest[kind, object_id] = deleted
+        upserted = [object_id for (kind, object_id), deleted
+                    in latest.items()
+                    if kind == ChangeLogEntry.RECIPE and not deleted]
+        rows = RecipeReadSerializer.values(
+            Recipe.objects.filter(id__in=upserted).order_by('id'))
+        recipes = RecipeReadSerializer(
+            rows, many=True, context={'request': request}).data
+        found = {recipe['id'] for recipe in recipes}
+        data = {
+            'cursor': entries[-1][0] if entries else since,
+            'has_more': has_more,
+            'recipes': {
+                'upserted': recipes,
+                'deleted': sorted(
+                    object_id for (kind, object_id), deleted
+                    in latest.items()
+                    if kind == ChangeLogEntry.RECIPE
+                    and (deleted or object_id not in found)),
+            },
+        }
+        for kind, (name, model, serializer) in CATALOGS.items():
+            changed = [object_id for entry_kind, object_id in latest
+                       if entry_kind == kind]
+            objects = []
+            if changed:
+                objects = serializer(
+                    serializer.values(model.objects.filter(id__in=changed)
+                                      .order_by('id')),
+                    many=True, context={'request': request}).data
+            found = {item['id'] for item in objects}
+            data[name] = {
+                'upserted': objects,
+                'deleted': sorted(set(changed) - found),
+            }
+        for kind, name in COLLECTIONS.items():
+            data[name] = {
+                'added': sorted(object_id for (entry_kind, object_id),
+                                deleted in latest.items()
+                                if entry_kind == kind and not deleted),
+                'removed': sorted(object_id for (entry_kind, object_id),
+                                  deleted in latest.items()
+                                  if entry_kind == kind and deleted),
+            }
+        return data
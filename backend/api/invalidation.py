@@ -0,0 +1,221 @@
+import collections
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import psycopg
+from django.conf import settings
+from django.db import connections
+
+from foodgram.metrics import CACHE_REQUESTS
+from .transactions import OnCommitBuffer
+
+logger = logging.getLogger('foodgram.invalidation')
+
+CHANNEL = 'foodgram_invalidation'
+# PostgreSQL ограничивает payload уведомления 8000 байтами.
+MAX_PAYLOAD_BYTES = 7900
+# Раз в столько секунд без уведомлений слушатель проверяет соединение.
+LISTEN_TIMEOUT = 60
+RECONNECT_DELAY = 5
+
+
+class InvalidationBus:
+    """Сброс кэшей в памяти процесса на всех воркерах и репликах.
+
+    publish(name, keys) после фиксации текущей транзакции сбрасывает
+    кэш name в своём процессе и отправляет pg_notify: до фиксации
+    другой запрос перечитал бы старую строку и снова положил её в кэш.
+    Сбросы одной транзакции объединяются. Поток-слушатель в каждом
+    процессе получает уведомления по LISTEN на отдельном соединении
+    и вызывает обработчики с remote=True. После потери соединения
+    уведомления могли пропасть, поэтому при подключении такие кэши
+    сбрасываются целиком.
+
+    LISTEN требует сессионного соединения: через PgBouncer в режиме
+    транзакций слушатель работать не будет.
+    """
+
+    handlers = {}
+    listener_pid = None
+    # pid процесса, чей слушатель сейчас подписан на канал.
+    listening_pid = None
+    start_lock = threading.Lock()
+
+    @classmethod
+    def register(cls, name, handler, remote=True):
+        """handler(keys) сбрасывает ключи keys или весь кэш при None;
+        remote=False — сбрасывать только в процессе, где была запись
+        (например, если кэш общий для всех процессов)."""
+        cls.handlers[name] = (handler, remote)
+
+    @staticmethod
+    def enabled():
+        return (settings.INVALIDATION_BUS
+                and connections['default'].vendor == 'postgresql')
+
+    @classmethod
+    def listening(cls):
+        """Слушатель этого процесса подписан на канал и получит
+        сбросы из других процессов."""
+        return cls.listening_pid == os.getpid()
+
+    @staticmethod
+    def sender():
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    @classmethod
+    def publish(cls, name, keys=None):
+        """Сбрасывает ключи keys кэша name (весь кэш при None)
+        после фиксации транзакции."""
+        if keys is None:
+            cls.pending.add({(name, None): True})
+        else:
+            cls.pending.add({(name, key): True for key in keys})
+
+    @classmethod
+    def send(cls, pending):
+        messages = {}
+        for name, key in pending:
+            if (name, None) in pending:
+                messages[name] = None
+            else:
+                messages.setdefault(name, []).append(key)
+        for name, keys in messages.items():
+            handler, _ = cls.handlers[name]
+            handler(keys)
+            if not cls.enabled():
+                continue
+            payload = json.dumps({'sender': cls.sender(), 'name': name,
+                                  'keys': keys})
+            if len(payload.encode()) > MAX_PAYLOAD_BYTES:
+                payload = json.dumps({'sender': cls.sender(), 'name': name,
+                                      'keys': None})
+            with connections['default'].cursor() as cursor:
+                cursor.execute('SELECT pg_notify(%s, %s)',
+                               [CHANNEL, payload])
+
+    pending = OnCommitBuffer(send)
+
+    @classmethod
+    def receive(cls, payload):
+        try:
+            message = json.loads(payload)
+            if message['sender'] == cls.sender():
+                return
+            handler, remote = cls.handlers.get(message['name'],
+                                               (None, False))
+            if remote:
+                handler(message['keys'])
+        except Exception:
+            # Сброс из сообщения мог не выполниться: сбрасываем всё.
+            logger.exception('Не удалось обработать уведомление '
+                             'о сбросе кэша: %r', payload)
+            cls.reset()
+
+    @classmethod
+    def reset(cls):
+        for handler, remote in cls.handlers.values():
+            if remote:
+                handler(None)
+
+    @classmethod
+    def listen(cls):
+        """Запускает слушателя в текущем процессе; после fork
+        воркера gunicorn — заново."""
+        pid = os.getpid()
+        if cls.listener_pid == pid:
+            return
+        with cls.start_lock:
+            if cls.listener_pid == pid:
+                return
+            cls.listener_pid = pid
+            if cls.enabled():
+                threading.Thread(target=cls.run, daemon=True,
+                                 name='invalidation-listener').start()
+
+    @classmethod
+    def run(cls):
+        """Слушает канал и переподключается после любой ошибки; пока
+        соединения нет, listening() ложно и кэши процесса не
+        используются."""
+        params = connections['default'].get_connection_params()
+        while True:
+            try:
+                with psycopg.connect(**params, autocommit=True) as conn:
+                    conn.execute(f'LISTEN {CHANNEL}')
+                    cls.reset()
+                    cls.listening_pid = os.getpid()
+                    while True:
+                        for notify in conn.notifies(timeout=LISTEN_TIMEOUT):
+                            cls.receive(notify.payload)
+                        conn.execute('SELECT 1')
+            except psycopg.Error as error:
+                logger.warning('Слушатель сброса кэшей потерял '
+                               'соединение: %s', error)
+            except Exception:
+                logger.exception('Слушатель сброса кэшей остановлен '
+                                 'ошибкой')
+            finally:
+                cls.listening_pid = None
+            time.sleep(RECONNECT_DELAY)
+
+
+class LocalCache:
+    """LRU-кэш в памяти процесса, согласованный через InvalidationBus.
+
+    Пока слушатель процесса не подписан на канал (шина выключена, база
+    не PostgreSQL, соединение переподключается), сбросы из других
+    процессов не доходят, и кэш не используется. Записи живут не
+    дольше timeout секунд, что ограничивает устаревание, если
+    уведомление всё же потеряется.
+    """
+
+    def __init__(self, name, timeout, max_entries=None):
+        self.name = name
+        self.timeout = timeout
+        self.max_entries = max_entries or settings.LOCAL_CACHE_MAX_ENTRIES
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # Увеличивается при каждом сбросе: значение, прочитанное из базы
+        # до сброса, не должно попасть в кэш после него.
+        self.version = 0
+        InvalidationBus.register(name, self.evict)
+
+    def get_or_set(self, key, compute):
+        InvalidationBus.listen()
+        if not InvalidationBus.listening():
+            return compute()
+        now = time.monotonic()
+        with self.lock:
+            expires, value = self.entries.get(key, (0, None))
+            if expires > now:
+                self.entries.move_to_end(key)
+                CACHE_REQUESTS.labels(self.name, 'hit').inc()
+                return value
+            self.entries.pop(key, None)
+            version = self.version
+        CACHE_REQUESTS.labels(self.name, 'miss').inc()
+        value = compute()
+        with self.lock:
+            if version == self.version:
+                self.entries[key] = (now + self.timeout, value)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return value
+
+    def evict(self, keys=None):
+        with self.lock:
+            self.version += 1
+            if keys is None:
+                self.entries.clear()
+                return
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def invalidate(self, keys=None):
+        """Сбрасывает ключи во всех процессах."""
+        InvalidationBus.publish(self.name, keys)
@@ -0,0 +1,184 @@
+import json
+import math
+import statistics
+import time
+import tracemalloc
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.contrib.auth.models import User
+from django.db.models import Count, Exists, OuterRef
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment)
+from rest_framework.test import APIClient
+
+from api.cache import AnonymousResponseCache, RecipeRepresentationCache
+from api.invalidation import InvalidationBus
+from foodgram.settings import BASE_DIR
+from recipes.models import Recipe, Tag
+
+DEFAULT_BUDGET = BASE_DIR.joinpath('data', 'benchmark_budget.json')
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку, число SQL-запросов и выделения памяти '
+            'для основных эндпоинтов API и сверяет их с бюджетом.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--budget', default=str(DEFAULT_BUDGET),
+                            help='JSON-файл с допустимыми значениями.')
+        parser.add_argument('--write-budget', action='store_true',
+                            help='Записать текущие замеры в файл бюджета.')
+
+    def handle(self, *args, **options):
+        # Пользователь с подписками и рецептом, который есть у него
+        # и в избранном, и в корзине: иначе фильтры, корзина и подписки
+        # замеряются на пустых ответах.
+        favorite_in_cart = Recipe.objects.filter(
+            favorite_by__user=OuterRef('pk'),
+            in_shopping_carts__user=OuterRef('pk'))
+        user = (User.objects
+                .annotate(total=Count('subscriptions__subscription'))
+                .filter(Exists(favorite_in_cart), total__gt=0)
+                .order_by('-total', 'id').first())
+        if user is None:
+            raise CommandError('Нет данных: выполните fill_db '
+                               'и generate_load_data.')
+        recipe = Recipe.objects.filter(
+            favorite_by__user=user, in_shopping_carts__user=user
+        ).order_by('id').first()
+
+        setup_test_environment()
+        anonymous = APIClient()
+        client = APIClient()
+        client.force_authenticate(user)
+        tags = '&'.join(f'tags={slug}' for slug
+                        in Tag.objects.values_list('slug', flat=True))
+
+        scenarios = {
+            'recipes_list': (anonymous, 'get', '/api/recipes/?limit=6'),
+            'recipes_list_filtered': (
+                client, 'get',
+                f'/api/recipes/?limit=6&is_favorited=1'
+                f'&is_in_shopping_cart=1&author={recipe.author_id}&{tags}'),
+            'recipes_list_authenticated': (
+                client, 'get', '/api/recipes/?limit=6'),
+            'recipe_detail': (client, 'get', f'/api/recipes/{recipe.id}/'),
+            'subscriptions': (
+                client, 'get', '/api/users/subscriptions/?recipes_limit=3'),
+            'ingredients_autocomplete': (
+                anonymous, 'get', '/api/ingredients/?name=са'),
+            'download_shopping_cart': (
+                client, 'get', '/api/recipes/download_shopping_cart/'),
+            'favorite_toggle': (
+                client, 'toggle', f'/api/recipes/{recipe.id}/favorite/'),
+            'shopping_cart_toggle': (
+                client, 'toggle',
+                f'/api/recipes/{recipe.id}/shopping_cart/'),
+        }
+
+        # Замеряется обработка запроса, а не ответы 429 и кэш ответов.
+        # Кэши в памяти процесса работают только при подписанном
+        # слушателе InvalidationBus; других процессов у замера нет,
+        # поэтому слушатель не нужен, а без кэшей warm_queries равнялись
+        # бы queries.
+        rates = dict.fromkeys(
+            settings.REST_FRAMEWORK.get('DEFAULT_THROTTLE_RATES', {}))
+        with override_settings(
+                REST_FRAMEWORK={**settings.REST_FRAMEWORK,
+                                'DEFAULT_THROTTLE_RATES': rates},
+                ADMISSION_HEAVY_VIEWS=set(), RESPONSE_CACHE_TIMEOUT=0), \
+                mock.patch.object(InvalidationBus, 'listening',
+                                  return_value=True):
+            results = {name: self.measure(*scenario, options['iterations'])
+                       for name, scenario in scenarios.items()}
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:28} p50={result["p50_ms"]:8.2f} мс '
+                f'p99={result["p99_ms"]:8.2f} мс '
+                f'запросов={result["queries"]:4} '
+                f'(с кэшем {result["warm_queries"]:4}) '
+                f'память={result["allocated_kb"]:8.1f} КБ')
+
+        if options['write_budget']:
+            with open(options['budget'], 'w', encoding='utf8') as file:
+                json.dump(self.budget(results), file, indent=4,
+                          sort_keys=True)
+                file.write('\n')
+            return
+        self.check_budget(results, options['budget'])
+
+    def request(self, client, method, url):
+        if method == 'toggle':
+            # Рецепт уже в избранном и корзине: удаление перед
+            # добавлением оставляет данные как были.
+            client.delete(url)
+            return client.post(url)
+        return getattr(client, method)(url)
+
+    def measure(self, client, method, url, iterations):
+        # Первый запрос на пустых кэшах: с прогретым кэшем представлений
+        # лишние запросы сериализаторов не видны. Кэши сбрасываются
+        # только в этом процессе, без рассылки через InvalidationBus.
+        RecipeRepresentationCache.evict(None)
+        AnonymousResponseCache.evict()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.request(client, method, url)
+        query_count = len(queries)
+        if response.status_code >= 400:
+            raise CommandError(f'{url} вернул {response.status_code}.')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.request(client, method, url)
+        warm_query_count = len(queries)
+
+        tracemalloc.start()
+        self.request(client, method, url)
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            self.request(client, method, url)
+            timings.append((time.perf_counter() - started) * 1000)
+        percentiles = statistics.quantiles(timings, n=100)
+        return {
+            'p50_ms': round(statistics.median(timings), 2),
+            'p99_ms': round(percentiles[98], 2),
+            'queries': query_count,
+            'warm_queries': warm_query_count,
+            'allocated_kb': round(allocated / 1024, 1),
+        }
+
+    @staticmethod
+    def budget(results):
+        """Бюджет по замерам: число запросов точно, память и p99
+        с запасом на разброс между машинами."""
+        return {name: {
+            'queries': result['queries'],
+            'warm_queries': result['warm_queries'],
+            'allocated_kb': math.ceil(result['allocated_kb'] * 1.5),
+            'p99_ms': max(100, math.ceil(result['p99_ms'] * 3 / 100) * 100),
+        } for name, result in results.items()}
+
+    def check_budget(self, results, path):
+        try:
+            with open(path, 'r', encoding='utf8') as file:
+                budget = json.load(file)
+        except FileNotFoundError:
+            raise CommandError(f'Файл бюджета {path} не найден.')
+
+        exceeded = [
+            f'{name}.{metric}: {results[name][metric]} > {limit}'
+            for name, limits in budget.items() if name in results
+            for metric, limit in limits.items()
+            if results[name].get(metric, 0) > limit
+        ]
+        if exceeded:
+            raise CommandError('Превышен бюджет производительности:\n'
+                               + '\n'.join(exceeded))
+        self.stdout.write(self.style.SUCCESS('Бюджет соблюдён.'))
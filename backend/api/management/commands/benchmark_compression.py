@@ -0,0 +1,66 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_test_environment
+from rest_framework.test import APIClient
+
+from foodgram.compression import available_encodings, compress
+from foodgram.settings import BASE_DIR
+from recipes.models import Recipe, ShoppingCart
+
+SCHEMA_PATH = BASE_DIR.parent.joinpath('docs', 'openapi-schema.yml')
+
+
+class Command(BaseCommand):
+    help = ('Показывает размер типичных ответов без сжатия, с gzip '
+            'и brotli, время сжатия и время передачи по каналу.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--mbit', type=float, default=10,
+                            help='Пропускная способность канала, Мбит/с.')
+
+    def handle(self, *args, **options):
+        recipe = Recipe.objects.order_by('id').first()
+        cart = ShoppingCart.objects.exclude(recipes=None).first()
+        if recipe is None or cart is None:
+            raise CommandError('Нет данных: выполните fill_db '
+                               'и generate_load_data.')
+        setup_test_environment()
+        client = APIClient()
+        client.force_authenticate(cart.user)
+
+        pages = {
+            'recipes_list': '/api/recipes/',
+            'recipes_list_100': '/api/recipes/?limit=100',
+            'recipe_detail': f'/api/recipes/{recipe.id}/',
+            'ingredients': '/api/ingredients/',
+            'subscriptions': '/api/users/subscriptions/?recipes_limit=3',
+            'shopping_list': '/api/recipes/download_shopping_cart/',
+        }
+        bodies = {}
+        # Замеряем сжатие отдельно, поэтому middleware не должен сжимать.
+        with override_settings(COMPRESSION_MIN_SIZE=float('inf')):
+            for name, path in pages.items():
+                bodies[name] = client.get(path).content
+        if SCHEMA_PATH.exists():
+            bodies['openapi_schema'] = SCHEMA_PATH.read_bytes()
+
+        seconds_per_byte = 8 / (options['mbit'] * 1_000_000)
+        for name, body in bodies.items():
+            line = [f'{name:18} {len(body) / 1024:8.1f} КБ']
+            for encoding in available_encodings():
+                timings = []
+                for _ in range(options['iterations']):
+                    started = time.perf_counter()
+                    compressed = compress(body, encoding)
+                    timings.append(time.perf_counter() - started)
+                spent = statistics.median(timings)
+                saved = (len(body) - len(compressed)) * seconds_per_byte
+                line.append(
+                    f'{encoding}: {len(compressed) / 1024:7.1f} КБ '
+                    f'({len(compressed) / len(body):4.0%}), '
+                    f'сжатие {spent * 1000:6.2f} мс, '
+                    f'выигрыш {(saved - spent) * 1000:7.1f} мс')
+            self.stdout.write(' | '.join(line))
@@ -0,0 +1,42 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает задержку запроса с новым соединением к БД '
+            '(или соединением из пула) и с постоянным соединением.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def handle(self, *args, **options):
+        pooled = 'pool' in connection.settings_dict.get('OPTIONS', {})
+        reconnect = self.measure(options['iterations'], reconnect=True)
+        persistent = self.measure(options['iterations'], reconnect=False)
+
+        title = 'Соединение из пула' if pooled else 'Новое соединение'
+        self.stdout.write(f'{title:22} p50={reconnect[0]:.3f} мс '
+                          f'p99={reconnect[1]:.3f} мс')
+        self.stdout.write(f'{"Постоянное соединение":22} '
+                          f'p50={persistent[0]:.3f} мс '
+                          f'p99={persistent[1]:.3f} мс')
+        self.stdout.write(self.style.SUCCESS(
+            f'Накладные расходы на соединение: '
+            f'{reconnect[0] - persistent[0]:.3f} мс на запрос.'))
+
+    def measure(self, iterations, reconnect):
+        timings = []
+        connection.ensure_connection()
+        for _ in range(iterations):
+            if reconnect:
+                connection.close()
+            started = time.perf_counter()
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            timings.append((time.perf_counter() - started) * 1000)
+        return (statistics.median(timings),
+                statistics.quantiles(timings, n=100)[98])
@@ -0,0 +1,86 @@
+import base64
+import io
+import json
+import os
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.parsers import OrjsonParser
+from api.renderers import OrjsonRenderer, orjson
+from api.serializers import RecipeSerializer
+from recipes.models import Ingredient, Recipe, Tag
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает JSONRenderer/JSONParser DRF с вариантами на orjson '
+            'на странице рецептов и на теле запроса с картинкой base64.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=100,
+                            help='Число рецептов на странице.')
+        parser.add_argument('--image-kb', type=int, default=512,
+                            help='Размер картинки в теле запроса.')
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            raise CommandError('orjson не установлен.')
+        recipes = list(Recipe.objects.select_related('author')
+                       .order_by('-id')[:options['recipes']])
+        if not recipes:
+            raise CommandError('Нет данных: выполните fill_db '
+                               'и generate_load_data.')
+        setup_test_environment()
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        page = {'count': len(recipes), 'next': None, 'previous': None,
+                'results': RecipeSerializer(
+                    recipes, many=True, context={'request': request}).data}
+
+        standard = JSONRenderer().render(page)
+        if OrjsonRenderer().render(page) != standard:
+            raise CommandError('Ответ OrjsonRenderer отличается '
+                               'от JSONRenderer.')
+        iterations = options['iterations']
+        self.report(f'Рендеринг {len(recipes)} рецептов '
+                    f'({len(standard) // 1024} КБ)',
+                    self.measure(JSONRenderer().render, page, iterations),
+                    self.measure(OrjsonRenderer().render, page, iterations))
+
+        image = base64.b64encode(os.urandom(options['image_kb'] * 1024))
+        body = json.dumps({
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'tags': list(Tag.objects.values_list('id', flat=True)[:3]),
+            'ingredients': [
+                {'id': pk, 'amount': 100} for pk in
+                Ingredient.objects.values_list('id', flat=True)[:10]],
+            'image': 'data:image/png;base64,' + image.decode(),
+        }).encode()
+        self.report(f'Разбор тела с картинкой ({len(body) // 1024} КБ)',
+                    self.measure(lambda data: JSONParser().parse(
+                        io.BytesIO(data)), body, iterations),
+                    self.measure(lambda data: OrjsonParser().parse(
+                        io.BytesIO(data)), body, iterations))
+
+    @staticmethod
+    def measure(function, data, iterations):
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            function(data)
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    def report(self, title, standard, fast):
+        self.stdout.write(f'{title}: json p50={standard:.3f} мс, '
+                          f'orjson p50={fast:.3f} мс')
+        self.stdout.write(self.style.SUCCESS(
+            f'Ускорение: {standard / fast:.1f}x'))
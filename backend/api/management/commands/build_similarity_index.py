@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from api.similarity import MinHashIndex
+from recipes.models import Recipe, RecipeIngredient, RecipeSimilarityBand
+
+
+class Command(BaseCommand):
+    help = ('Строит MinHash/LSH-индекс похожих рецептов. Нужен после '
+            'загрузки данных и после изменения SIMILAR_RECIPES_*.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        indexed = last_id = 0
+        while True:
+            recipe_ids = list(
+                Recipe.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:options['batch_size']])
+            if not recipe_ids:
+                break
+            last_id = recipe_ids[-1]
+            pairs = (RecipeIngredient.objects
+                     .filter(recipe_id__gte=recipe_ids[0],
+                             recipe_id__lte=last_id)
+                     .order_by('recipe_id')
+                     .values_list('recipe_id', 'ingredient_id'))
+            MinHashIndex.index(recipe_ids, pairs)
+            indexed += len(recipe_ids)
+            self.stdout.write(f'Проиндексировано рецептов: {indexed}')
+
+        largest = (RecipeSimilarityBand.objects
+                   .values('band', 'bucket').annotate(size=Count('id'))
+                   .order_by('-size').values_list('size', flat=True)
+                   .first())
+        self.stdout.write(self.style.SUCCESS(
+            f'Индекс построен за {time.perf_counter() - started:.1f} с, '
+            f'самая большая корзина: {largest or 0} рецептов.'))
@@ -0,0 +1,109 @@
+import itertools
+import re
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.http import QueryDict
+
+from api.paginators import UsersAndRecipeListAPIPagination
+from api.utils import RECIPE_ORDERINGS, RecipeManager
+from recipes.models import Recipe
+
+FULL_SCAN = {
+    'postgresql': re.compile(r'Seq Scan on (recipes_recipe(?:_tags)?)\b'),
+    'sqlite': re.compile(r'^SCAN (recipes_recipe(?:_tags)?)(?: AS \w+)?$',
+                         re.MULTILINE),
+}
+SORT = {
+    'postgresql': re.compile(r'\bSort\b'),
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR ORDER BY'),
+}
+INDEX = {
+    'postgresql': re.compile(r'(?:Index (?:Only )?Scan(?: Backward)? using'
+                             r'|Bitmap Index Scan on) (\w+)'),
+    'sqlite': re.compile(r'INDEX (\w+)'),
+}
+
+
+class Command(BaseCommand):
+    help = ('Проверяет планы запросов списка рецептов для всех сочетаний '
+            'фильтров ?author=, ?tags=, ?cooking_time_min/max=, '
+            '?created_after= и сортировок ?ordering=.')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in FULL_SCAN:
+            raise CommandError(f'Планы {vendor} не поддерживаются.')
+        recipe = Recipe.objects.filter(tags__isnull=False).order_by(
+            'id').values('author_id', 'tags__slug', 'created_at',
+                         'cooking_time').first()
+        if recipe is None:
+            raise CommandError('Нет данных: выполните fill_db '
+                               'и generate_load_data.')
+        filters = {
+            'author': {'author': recipe['author_id']},
+            'tags': {'tags': recipe['tags__slug']},
+            'cooking_time': {'cooking_time_min': recipe['cooking_time'],
+                             'cooking_time_max': recipe['cooking_time'] + 10},
+            'created_after': {
+                'created_after': recipe['created_at'].isoformat()},
+        }
+        orderings = [None, *(prefix + ordering
+                             for ordering in RECIPE_ORDERINGS
+                             for prefix in ('', '-'))]
+
+        failures = 0
+        for size in range(len(filters) + 1):
+            for names in itertools.combinations(filters, size):
+                for ordering in orderings:
+                    params = QueryDict(mutable=True)
+                    for name in names:
+                        params.update(filters[name])
+                    if ordering:
+                        params['ordering'] = ordering
+                    plan = self.explain(params)
+                    problem = self.problem(vendor, plan)
+                    indexes = ', '.join(sorted(set(
+                        INDEX[vendor].findall(plan)))) or '—'
+                    query = params.urlencode() or '(без параметров)'
+                    if problem:
+                        failures += 1
+                        self.stdout.write(self.style.ERROR(
+                            f'{query}: {problem}\n{plan}'))
+                    else:
+                        self.stdout.write(f'{query}: {indexes}')
+        if failures:
+            raise CommandError(f'Планов без подходящего индекса: '
+                               f'{failures}.')
+        self.stdout.write(self.style.SUCCESS('Все планы используют индексы.'))
+
+    @staticmethod
+    def explain(params):
+        queryset = RecipeManager.filter_recipes(
+            Recipe.objects.order_by('-id'), params, AnonymousUser())
+        sql, sql_params = queryset.values('id')[
+            :UsersAndRecipeListAPIPagination.page_size].query.sql_with_params()
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Оценки на маленькой базе выбирают Seq Scan, даже когда
+                # индекс есть; без него план показывает, найдётся ли
+                # индекс на большой.
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(
+                f'{connection.ops.explain_query_prefix()} {sql}', sql_params)
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    @staticmethod
+    def problem(vendor, plan):
+        """Описание проблемы плана или None.
+
+        Полный просмотр рецептов допустим только в порядке id без
+        сортировки: тогда LIMIT останавливает его на первой странице.
+        """
+        tables = set(FULL_SCAN[vendor].findall(plan))
+        if 'recipes_recipe_tags' in tables:
+            return 'полный просмотр recipes_recipe_tags'
+        if 'recipes_recipe' in tables and SORT[vendor].search(plan):
+            return 'полный просмотр recipes_recipe с сортировкой'
+        return None
@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+from recipes.models import ChangeLogEntry
+
+
+class Command(BaseCommand):
+    help = ('Сжимает журнал изменений: оставляет только последнюю '
+            'запись по каждому объекту и удаляет старые записи об '
+            'удалении.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tombstone-days', type=int, default=None,
+            help='Удалять записи об удалении старше стольких дней. '
+                 'Клиенты с более старым курсором получат 410 и '
+                 'загрузят данные заново.')
+
+    def handle(self, *args, **options):
+        entries = ChangeLogEntry.objects.exclude(kind=ChangeLogEntry.RESET)
+        newer = entries.filter(kind=OuterRef('kind'),
+                               object_id=OuterRef('object_id'),
+                               id__gt=OuterRef('id'))
+        with transaction.atomic():
+            # NULL не равен NULL, поэтому общие записи и записи
+            # пользователей сжимаются отдельно.
+            superseded, _ = entries.filter(user=None).filter(
+                Exists(newer.filter(user=None))).delete()
+            superseded += entries.filter(user__isnull=False).filter(
+                Exists(newer.filter(user=OuterRef('user')))).delete()[0]
+        self.stdout.write(f'Удалено устаревших записей: {superseded}')
+
+        if options['tombstone_days'] is None:
+            return
+        tombstones = entries.filter(
+            deleted=True, created_at__lt=timezone.now() - timedelta(
+                days=options['tombstone_days']))
+        with transaction.atomic():
+            horizon = tombstones.aggregate(horizon=Max('id'))['horizon']
+            if horizon is None:
+                return
+            removed, _ = tombstones.filter(id__lte=horizon).delete()
+            ChangeLogEntry.objects.create(kind=ChangeLogEntry.RESET,
+                                          object_id=horizon)
+        self.stdout.write(f'Удалено записей об удалении: {removed}')
@@ -0,0 +1,141 @@
+from collections import Counter
+from itertools import combinations, groupby
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from api.similarity import NearDuplicates
+from recipes.models import Recipe, RecipeIngredient, RecipeSimilarityBand
+
+
+def jaccard(first, second):
+    union = first | second
+    return len(first & second) / len(union) if union else 0
+
+
+class Command(BaseCommand):
+    help = ('Ищет группы рецептов-дубликатов: с одинаковой сигнатурой '
+            'и с похожими ингредиентами и названиями по LSH-индексу '
+            'build_similarity_index. Заодно заполняет пустые сигнатуры.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--ingredients-threshold', type=float,
+                            default=0.8)
+        parser.add_argument('--name-threshold', type=float, default=0.6)
+        parser.add_argument('--min-bands', type=int, default=4,
+                            help='Сколько полос LSH должно совпасть, '
+                                 'чтобы пара стала кандидатом.')
+        parser.add_argument('--max-bucket', type=int, default=100,
+                            help='Корзины LSH больше этого размера '
+                                 'пропускаются: число пар растёт как '
+                                 'квадрат размера корзины.')
+        parser.add_argument('--limit', type=int, default=50,
+                            help='Сколько самых больших групп вывести.')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.parents = {}
+        filled = self.fill_signatures()
+        if filled:
+            self.stdout.write(f'Заполнено сигнатур: {filled}')
+
+        for recipe_ids in self.same_signature():
+            for recipe_id in recipe_ids[1:]:
+                self.union(recipe_ids[0], recipe_id)
+        pairs = self.candidate_pairs()
+        for first, second in self.verified(pairs):
+            self.union(first, second)
+
+        clusters = {}
+        for recipe_id in self.parents:
+            clusters.setdefault(self.find(recipe_id), []).append(recipe_id)
+        clusters = sorted((sorted(ids) for ids in clusters.values()),
+                          key=lambda ids: (-len(ids), ids[0]))
+        names = dict(Recipe.objects.filter(id__in=[
+            recipe_id for ids in clusters[:options['limit']]
+            for recipe_id in ids]).values_list('id', 'name'))
+        for ids in clusters[:options['limit']]:
+            self.stdout.write(f'{len(ids)} рецептов: ' + '; '.join(
+                f'{recipe_id} «{names[recipe_id]}»' for recipe_id in ids))
+        self.stdout.write(self.style.SUCCESS(
+            f'Групп дубликатов: {len(clusters)}, рецептов в них: '
+            f'{sum(map(len, clusters))}.'))
+
+    def find(self, recipe_id):
+        parent = self.parents.setdefault(recipe_id, recipe_id)
+        if parent != recipe_id:
+            parent = self.parents[recipe_id] = self.find(parent)
+        return parent
+
+    def union(self, first, second):
+        self.parents[self.find(second)] = self.find(first)
+
+    def fill_signatures(self):
+        filled = 0
+        while True:
+            recipes = list(Recipe.objects.filter(duplicate_signature='')
+                           .only('id', 'name')
+                           [:self.options['batch_size']])
+            if not recipes:
+                return filled
+            ingredients = {recipe.id: [] for recipe in recipes}
+            for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+                    recipe_id__in=ingredients).values_list(
+                    'recipe_id', 'ingredient_id'):
+                ingredients[recipe_id].append(ingredient_id)
+            for recipe in recipes:
+                recipe.duplicate_signature = NearDuplicates.signature(
+                    recipe.name, ingredients[recipe.id])
+            Recipe.objects.bulk_update(recipes, ['duplicate_signature'])
+            filled += len(recipes)
+
+    def same_signature(self):
+        signatures = (Recipe.objects.values('duplicate_signature')
+                      .annotate(total=Count('id')).filter(total__gt=1)
+                      .values_list('duplicate_signature', flat=True))
+        rows = (Recipe.objects.filter(duplicate_signature__in=signatures)
+                .order_by('duplicate_signature', 'id')
+                .values_list('duplicate_signature', 'id'))
+        for _, group in groupby(rows.iterator(), key=lambda row: row[0]):
+            yield [recipe_id for _, recipe_id in group]
+
+    def candidate_pairs(self):
+        """Пары рецептов, совпавшие хотя бы в min-bands полосах.
+
+        Большие корзины (общие ингредиенты вроде соли и муки) дают почти
+        только случайные пары и пропускаются целиком.
+        """
+        matches = Counter()
+        rows = (RecipeSimilarityBand.objects.order_by('band', 'bucket')
+                .values_list('band', 'bucket', 'recipe_id'))
+        for _, group in groupby(rows.iterator(chunk_size=10000),
+                                key=lambda row: row[:2]):
+            recipe_ids = sorted(row[2] for row in group)
+            if 1 < len(recipe_ids) <= self.options['max_bucket']:
+                matches.update(combinations(recipe_ids, 2))
+        return [pair for pair, count in matches.items()
+                if count >= self.options['min_bands']]
+
+    def verified(self, pairs):
+        """Пары с близкими наборами ингредиентов и названиями."""
+        batch_size = self.options['batch_size']
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            recipe_ids = {recipe_id for pair in batch for recipe_id in pair}
+            ingredients = {recipe_id: set() for recipe_id in recipe_ids}
+            for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+                    recipe_id__in=recipe_ids).values_list(
+                    'recipe_id', 'ingredient_id'):
+                ingredients[recipe_id].add(ingredient_id)
+            shingles = {
+                recipe_id: NearDuplicates.shingles(name)
+                for recipe_id, name in Recipe.objects.filter(
+                    id__in=recipe_ids).values_list('id', 'name')}
+            for first, second in batch:
+                if (first in shingles and second in shingles
+                        and jaccard(ingredients[first], ingredients[second])
+                        >= self.options['ingredients_threshold']
+                        and jaccard(shingles[first], shingles[second])
+                        >= self.options['name_threshold']):
+                    yield first, second
@@ -0,0 +1,64 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand
+
+DEFAULT_PATHS = (
+    '/api/recipes/',
+    '/api/recipes/?limit=20&tags=breakfast&tags=lunch',
+    '/api/tags/',
+    '/api/ingredients/?name=са',
+)
+
+
+class Command(BaseCommand):
+    help = ('Нагружает запущенный сервер параллельными GET-запросами, '
+            'чтобы сравнить WSGI- и ASGI-режимы.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--token', default=None,
+                            help='Токен для авторизованных запросов.')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Путь для запросов; можно указать '
+                                 'несколько раз.')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or DEFAULT_PATHS
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        urls = [options['url'] + quote(paths[index % len(paths)],
+                                       safe='/?=&')
+                for index in range(options['requests'])]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            results = list(executor.map(
+                lambda url: self.fetch(url, headers), urls))
+        elapsed = time.perf_counter() - started
+
+        timings = sorted(timing for timing, _ in results)
+        errors = sum(1 for _, status in results if status >= 400)
+        percentiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(
+            f'Запросов: {len(results)}, ошибок: {errors}, '
+            f'{len(results) / elapsed:.1f} запросов/с, '
+            f'p50={statistics.median(timings):.1f} мс, '
+            f'p99={percentiles[98]:.1f} мс')
+
+    def fetch(self, url, headers):
+        started = time.perf_counter()
+        try:
+            with urlopen(Request(url, headers=headers)) as response:
+                response.read()
+                status = response.status
+        except HTTPError as error:
+            status = error.code
+        return (time.perf_counter() - started) * 1000, status
@@ -0,0 +1,50 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.nutrition import NutritionCalculator
+from recipes.models import Recipe, RecipeIngredient
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает пищевую ценность всех рецептов: после '
+            'загрузки данных о пищевой ценности или массовых правок.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200_000,
+                            help='Сколько рецептов считать за раз.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        matrix = NutritionCalculator.matrix()
+        table = RecipeIngredient._meta.db_table
+        total = last_id = 0
+        while True:
+            recipe_ids = np.fromiter(
+                Recipe.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:options['batch_size']]
+                .iterator(chunk_size=options['batch_size']),
+                dtype=np.int64)
+            if not len(recipe_ids):
+                break
+            last_id = int(recipe_ids[-1])
+            # Миллионы строк быстрее читать курсором, чем через ORM.
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'SELECT recipe_id, ingredient_id, amount FROM {table} '
+                    'WHERE recipe_id BETWEEN %s AND %s',
+                    [int(recipe_ids[0]), last_id])
+                pairs = cursor.fetchall()
+            NutritionCalculator.save(
+                recipe_ids.tolist(),
+                NutritionCalculator.recipe_totals(matrix, recipe_ids, pairs))
+            total += len(recipe_ids)
+            self.stdout.write(f'Пересчитано рецептов: {total}')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Пищевая ценность пересчитана для {total} рецептов за '
+            f'{elapsed:.1f} с ({total / elapsed if elapsed else 0:.0f} '
+            'рецептов/с).'))
@@ -0,0 +1,230 @@
+import io
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+from .cache import AnonymousResponseCache
+from .transactions import OnCommitBuffer
+
+NUTRIENTS = ('calories', 'proteins', 'fats', 'carbohydrates')
+NUTRIENT_LABELS = {
+    'calories': ('Калории', 'ккал'),
+    'proteins': ('Белки', 'г'),
+    'fats': ('Жиры', 'г'),
+    'carbohydrates': ('Углеводы', 'г'),
+}
+# Пищевая ценность ингредиента задана на 100 единиц измерения.
+PER_UNITS = 100
+
+
+class NutritionCalculator:
+    """Пищевая ценность рецептов и корзин.
+
+    Значения ингредиентов собираются в матрицу ингредиент × нутриент
+    (строка — id ингредиента), итог рецепта — произведение вектора
+    количеств на строки его ингредиентов. Строки ингредиентов без
+    данных — NaN: итог рецепта с таким ингредиентом (или без
+    ингредиентов) неизвестен и хранится как NULL, а не как заниженная
+    сумма. Итоги хранятся в полях рецепта, чтобы по ним можно было
+    фильтровать.
+    """
+
+    @staticmethod
+    def matrix(ingredient_ids=None):
+        """Матрица пищевой ценности; строки индексируются id
+        ингредиента. Без аргумента — по всему справочнику."""
+        ingredients = Ingredient.objects.all()
+        if ingredient_ids is not None:
+            ingredients = ingredients.filter(id__in=ingredient_ids)
+        rows = list(ingredients.exclude(calories=None).values_list(
+            'id', *NUTRIENTS))
+        rows = np.array(rows, dtype=np.float64).reshape(
+            -1, 1 + len(NUTRIENTS))
+        # Последняя строка — для id без данных, больших всех известных.
+        size = int(rows[:, 0].max()) + 2 if len(rows) else 1
+        matrix = np.full((size, len(NUTRIENTS)), np.nan)
+        # У ингредиента с известной калорийностью пустые белки, жиры
+        # или углеводы считаются нулём.
+        matrix[rows[:, 0].astype(np.int64)] = np.nan_to_num(rows[:, 1:])
+        return matrix / PER_UNITS
+
+    @staticmethod
+    def rows(matrix, ingredient_ids):
+        """Строки матрицы для ингредиентов; id вне матрицы — NaN."""
+        return matrix[np.minimum(np.asarray(ingredient_ids, dtype=np.int64),
+                                 len(matrix) - 1)]
+
+    @staticmethod
+    def values(totals):
+        """Итоги рецепта для полей модели: None, если итог неизвестен."""
+        totals = np.asarray(totals, dtype=np.float64)
+        if np.isnan(totals).any():
+            return dict.fromkeys(NUTRIENTS)
+        return dict(zip(NUTRIENTS, totals.tolist()))
+
+    @classmethod
+    def totals(cls, matrix, ingredient_ids, amounts):
+        """Итог по ингредиентам: amounts @ matrix[ingredient_ids]."""
+        if not len(ingredient_ids):
+            return np.full(len(NUTRIENTS), np.nan)
+        return np.asarray(amounts, dtype=np.float64) @ cls.rows(
+            matrix, ingredient_ids)
+
+    @classmethod
+    def ingredient_totals(cls, ingredients, amounts):
+        """Итоги для уже загруженных объектов Ingredient без запросов
+        к базе: поля для Recipe.objects.create() или update()."""
+        matrix = np.array([[getattr(ingredient, name) or 0
+                            for name in NUTRIENTS]
+                           if ingredient.calories is not None
+                           else [np.nan] * len(NUTRIENTS)
+                           for ingredient in ingredients],
+                          dtype=np.float64).reshape(-1, len(NUTRIENTS))
+        return cls.values(cls.totals(matrix / PER_UNITS,
+                                     np.arange(len(matrix)), amounts))
+
+    @staticmethod
+    def shopping_list_section(items):
+        """Строки о пищевой ценности для списка покупок по строкам
+        RecipeIngredient.values() с полями ingredient__<нутриент>
+        и total_amount."""
+        known = [item for item in items
+                 if item['ingredient__calories'] is not None]
+        if not known:
+            return []
+        matrix = np.array([[item[f'ingredient__{name}'] or 0
+                            for name in NUTRIENTS] for item in known],
+                          dtype=np.float64)
+        amounts = np.array([item['total_amount'] for item in known],
+                           dtype=np.float64)
+        totals = amounts @ matrix / PER_UNITS
+        lines = ['', 'Пищевая ценность:']
+        lines += [f'{NUTRIENT_LABELS[name][0]} — {value:.0f} '
+                  f'{NUTRIENT_LABELS[name][1]}'
+                  for name, value in zip(NUTRIENTS, totals.tolist())]
+        missing = len(items) - len(known)
+        if missing:
+            lines.append(f'Без учёта ингредиентов без данных: {missing}.')
+        return lines
+
+    @classmethod
+    def recipe_totals(cls, matrix, recipe_ids, pairs):
+        """Итоги рецептов по парам (рецепт, ингредиент, количество):
+        массив формы (len(recipe_ids), число нутриентов); NaN в строке
+        рецепта, итог которого неизвестен."""
+        recipe_ids = np.asarray(recipe_ids, dtype=np.int64)
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 3)
+        positions = np.searchsorted(recipe_ids, pairs[:, 0])
+        contributions = cls.rows(matrix, pairs[:, 1]) * pairs[:, 2, None]
+        # NaN ингредиента без данных переходит в сумму рецепта.
+        totals = np.column_stack([
+            np.bincount(positions, weights=contributions[:, column],
+                        minlength=len(recipe_ids))
+            for column in range(len(NUTRIENTS))])
+        totals[np.bincount(positions, minlength=len(recipe_ids)) == 0] = (
+            np.nan)
+        return totals
+
+    @classmethod
+    def refresh(cls, recipe_ids, matrix=None):
+        """Пересчитывает сохранённые итоги рецептов."""
+        recipe_ids = sorted(set(recipe_ids))
+        if not recipe_ids:
+            return
+        pairs = list(RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids).values_list(
+            'recipe_id', 'ingredient_id', 'amount'))
+        if matrix is None:
+            matrix = cls.matrix({pair[1] for pair in pairs})
+        cls.save(recipe_ids, cls.recipe_totals(matrix, recipe_ids, pairs))
+
+    @classmethod
+    def refresh_recipes(cls, recipe_ids):
+        cls.refresh(recipe_ids)
+        # Ответы с ?max_calories= могли закэшироваться до пересчёта.
+        AnonymousResponseCache.invalidate_all()
+
+    # Рецепты, состав которых изменился в транзакции; пересчитываются
+    # один раз после её фиксации.
+    changed_recipes = OnCommitBuffer(refresh_recipes)
+
+    @classmethod
+    def refresh_later(cls, recipe_ids):
+        cls.changed_recipes.add(dict.fromkeys(recipe_ids))
+
+    @classmethod
+    def refresh_ingredients(cls, ingredient_ids):
+        """Пересчитывает рецепты с ингредиентами пачками по
+        NUTRITION_REFRESH_BATCH_SIZE, каждую в своей транзакции: частый
+        ингредиент входит в тысячи рецептов."""
+        recipe_ids = (RecipeIngredient.objects
+                      .filter(ingredient_id__in=list(ingredient_ids))
+                      .order_by('recipe_id').distinct()
+                      .values_list('recipe_id', flat=True))
+        last_id = refreshed = 0
+        while True:
+            batch = list(recipe_ids.filter(recipe_id__gt=last_id)[
+                :settings.NUTRITION_REFRESH_BATCH_SIZE])
+            if not batch:
+                break
+            cls.refresh(batch)
+            last_id = batch[-1]
+            refreshed += len(batch)
+        if refreshed:
+            # Ответы с ?max_calories= могли закэшироваться до пересчёта.
+            AnonymousResponseCache.invalidate_all()
+
+    # Ингредиенты, изменённые в транзакции; рецепты с ними
+    # пересчитываются после её фиксации.
+    changed_ingredients = OnCommitBuffer(refresh_ingredients)
+
+    @classmethod
+    def ingredients_changed(cls, ingredient_ids):
+        cls.changed_ingredients.add(dict.fromkeys(ingredient_ids))
+
+    @classmethod
+    def save(cls, recipe_ids, totals):
+        if connection.vendor == 'postgresql':
+            return cls.copy(recipe_ids, totals)
+        # bulk_update строит CASE по всем строкам, executemany быстрее.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE {Recipe._meta.db_table} SET '
+                + ', '.join(f'{name} = %s' for name in NUTRIENTS)
+                + ' WHERE id = %s',
+                [(*cls.values(row).values(), recipe_id)
+                 for recipe_id, row in zip(recipe_ids, totals)])
+
+    @staticmethod
+    def copy(recipe_ids, totals):
+        """Записывает итоги через COPY во временную таблицу и один
+        UPDATE ... FROM: bulk_update на миллионе строк слишком медленный.
+        """
+        table = Recipe._meta.db_table
+        columns = ', '.join(NUTRIENTS)
+        data = io.StringIO()
+        np.savetxt(data, np.column_stack([recipe_ids, totals]),
+                   fmt=['%d'] + ['%.3f'] * len(NUTRIENTS), delimiter=',')
+        # Пустое поле CSV — NULL; чисел с «nan» внутри не бывает.
+        csv = data.getvalue().replace('nan', '')
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Во внешней транзакции ON COMMIT DROP удалит таблицу только
+            # при её фиксации, а copy() может вызываться в ней не раз.
+            cursor.execute('DROP TABLE IF EXISTS nutrition_import')
+            cursor.execute(
+                'CREATE TEMP TABLE nutrition_import (id bigint, '
+                + ', '.join(f'{name} double precision'
+                            for name in NUTRIENTS)
+                + ') ON COMMIT DROP')
+            with cursor.cursor.copy(
+                    f'COPY nutrition_import (id, {columns}) FROM STDIN '
+                    'WITH CSV') as copy:
+                copy.write(csv)
+            cursor.execute(
+                f'UPDATE {table} SET '
+                + ', '.join(f'{name} = nutrition_import.{name}'
+                            for name in NUTRIENTS)
+                + f' FROM nutrition_import WHERE {table}.id = '
+                'nutrition_import.id')
@@ -0,0 +1,31 @@
+import codecs
+import io
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+from .renderers import OrjsonRenderer, orjson
+
+
+class OrjsonParser(JSONParser):
+    """JSONParser на orjson.
+
+    Тело не в UTF-8, режим без STRICT_JSON и всё, что orjson
+    не принимает, разбирает стандартный JSONParser, поэтому ответы
+    об ошибках не меняются.
+    """
+
+    renderer_class = OrjsonRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if (orjson is None or not self.strict
+                or codecs.lookup(encoding).name != 'utf-8'):
+            return super().parse(stream, media_type, parser_context)
+        data = stream.read()
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return super().parse(io.BytesIO(data), media_type,
+                                 parser_context)
@@ -0,0 +1,267 @@
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from django.utils.functional import cached_property
+
+from foodgram.profiling import segment
+from recipes.models import Recipe, RecipeIngredient
+from .cache import RecipeRepresentationCache
+from .utils import RecipeManager
+
+USER_FIELDS = ('id', 'username', 'first_name', 'last_name', 'email')
+TAG_FIELDS = ('id', 'name', 'color', 'slug')
+INGREDIENT_FIELDS = ('id', 'name', 'measurement_unit')
+SHORT_RECIPE_FIELDS = ('id', 'name', 'image', 'cooking_time')
+
+
+def image_url(request, name):
+    if not name:
+        return None
+    url = Recipe._meta.get_field('image').storage.url(name)
+    return request.build_absolute_uri(url) if request else url
+
+
+class ReadSerializer:
+    """Лёгкая замена ModelSerializer для GET-запросов.
+
+    Получает строки .values(*fields), пачкой загружает связанные данные
+    и собирает те же словари, что и обычный сериализатор, без обхода
+    полей DRF для каждого объекта.
+
+    Параметры ?fields= и ?omit= (имена через запятую) выбирают поля
+    ответа из output_fields; невыбранные поля не читаются из базы,
+    и связанные с ними запросы не выполняются.
+    """
+
+    fields = ()
+    output_fields = ()
+
+    def __init__(self, instance=None, many=False, context=None, **kwargs):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+
+    @classmethod
+    def selected_fields(cls, request):
+        selected = set(cls.output_fields or cls.fields)
+        params = getattr(request, 'query_params', {})
+        if params.get('fields'):
+            selected &= set(params['fields'].split(','))
+        if params.get('omit'):
+            selected -= set(params['omit'].split(','))
+        return selected
+
+    @classmethod
+    def columns(cls, selected):
+        return [field for field in cls.fields
+                if field in selected or field == 'id']
+
+    @classmethod
+    def values(cls, queryset, request=None):
+        return queryset.values(*cls.columns(cls.selected_fields(request)))
+
+    @property
+    def request(self):
+        return self.context.get('request')
+
+    @property
+    def user(self):
+        return getattr(self.request, 'user', None)
+
+    @cached_property
+    def selected(self):
+        return self.selected_fields(self.request)
+
+    @property
+    @segment('serializer')
+    def data(self):
+        rows = list(self.instance) if self.many else [self.instance]
+        data = self.to_representation(rows)
+        output_fields = self.output_fields or self.fields
+        if len(self.selected) < len(output_fields):
+            data = [{field: item[field] for field in output_fields
+                     if field in self.selected} for item in data]
+        return data if self.many else data[0]
+
+    def to_representation(self, rows):
+        return [dict(row) for row in rows]
+
+
+class TagReadSerializer(ReadSerializer):
+    fields = TAG_FIELDS
+
+
+class IngredientReadSerializer(ReadSerializer):
+    fields = INGREDIENT_FIELDS
+
+
+class UserReadSerializer(ReadSerializer):
+    fields = USER_FIELDS
+    output_fields = USER_FIELDS + ('is_subscribed',)
+
+    def to_representation(self, rows):
+        if 'is_subscribed' not in self.selected:
+            return [dict(row) for row in rows]
+        subscribed = RecipeManager.subscribed_authors(
+            self.user, [row['id'] for row in rows])
+        return [{**row, 'is_subscribed': row['id'] in subscribed}
+                for row in rows]
+
+
+class SubscriptionReadSerializer(UserReadSerializer):
+    output_fields = (*UserReadSerializer.output_fields, 'recipes',
+                     'recipes_count')
+
+    def to_representation(self, rows):
+        authors = super().to_representation(rows)
+        author_ids = [author['id'] for author in authors]
+
+        author_recipes = {author_id: [] for author_id in author_ids}
+        if 'recipes' in self.selected:
+            recipes = Recipe.objects.filter(
+                author_id__in=author_ids).annotate(
+                position=Window(RowNumber(), partition_by=F('author_id'),
+                                order_by=F('id').asc()))
+            recipes_limit = self.request.query_params.get('recipes_limit')
+            if recipes_limit:
+                recipes = recipes.filter(position__lte=int(recipes_limit))
+            for row in recipes.order_by('id').values('author_id',
+                                                     *SHORT_RECIPE_FIELDS):
+                author_id = row.pop('author_id')
+                row['image'] = image_url(self.request, row['image'])
+                author_recipes[author_id].append(row)
+        counts = {}
+        if 'recipes_count' in self.selected:
+            counts = dict(Recipe.objects.filter(author_id__in=author_ids)
+                          .values('author_id').annotate(total=Count('id'))
+                          .values_list('author_id', 'total'))
+
+        return [{
+            **author,
+            'recipes': author_recipes[author['id']],
+            'recipes_count': counts.get(author['id'], 0),
+        } for author in authors]
+
+
+class ShortRecipeReadSerializer(ReadSerializer):
+    fields = SHORT_RECIPE_FIELDS
+
+    def to_representation(self, rows):
+        if 'image' not in self.selected:
+            return [dict(row) for row in rows]
+        return [{**row, 'image': image_url(self.request, row['image'])}
+                for row in rows]
+
+
+class RecipeReadSerializer(ReadSerializer):
+    """Собирает ответ RecipeSerializer из строк .values().
+
+    Не зависящая от пользователя часть берётся из кэша представлений
+    или строится двумя запросами на всю страницу; флаги пользователя
+    и абсолютный адрес картинки накладываются поверх.
+    """
+
+    fields = ('id', 'name', 'text', 'image', 'cooking_time', 'author_id',
+              *(f'author__{field}' for field in USER_FIELDS[1:]))
+    output_fields = ('id', 'author', 'tags', 'ingredients', 'is_favorited',
+                     'is_in_shopping_cart', 'name', 'text', 'image',
+                     'cooking_time')
+    # Поля, ради которых нужен кэш представлений или его построение.
+    cached_fields = {'tags', 'ingredients'}
+
+    @classmethod
+    def columns(cls, selected):
+        if selected & cls.cached_fields:
+            return list(cls.fields)
+        columns = ['id', *(field for field in ('name', 'text', 'image',
+                                               'cooking_time')
+                           if field in selected)]
+        if 'author' in selected:
+            columns += cls.fields[5:]
+        return columns
+
+    def build(self, rows):
+        recipe_ids = [row['id'] for row in rows]
+        tags = {recipe_id: [] for recipe_id in recipe_ids}
+        for recipe_id, *values in (
+                Recipe.tags.through.objects
+                .filter(recipe_id__in=recipe_ids).order_by('tag_id')
+                .values_list('recipe_id',
+                             *(f'tag__{field}' for field in TAG_FIELDS))):
+            tags[recipe_id].append(dict(zip(TAG_FIELDS, values)))
+        ingredients = {recipe_id: [] for recipe_id in recipe_ids}
+        for recipe_id, *values in (
+                RecipeIngredient.objects
+                .filter(recipe_id__in=recipe_ids).order_by('id')
+                .values_list('recipe_id',
+                             *(f'ingredient__{field}'
+                               for field in INGREDIENT_FIELDS),
+                             'amount')):
+            ingredients[recipe_id].append(
+                dict(zip(INGREDIENT_FIELDS + ('amount',), values)))
+
+        return {row['id']: {
+            'id': row['id'],
+            'author': {
+                'id': row['author_id'],
+                **{field: row[f'author__{field}']
+                   for field in USER_FIELDS[1:]},
+                'is_subscribed': False,
+            },
+            'tags': tags[row['id']],
+            'ingredients': ingredients[row['id']],
+            'is_favorited': False,
+            'is_in_shopping_cart': False,
+            'name': row['name'],
+            'text': row['text'],
+            'image': None,
+            'cooking_time': row['cooking_time'],
+        } for row in rows}
+
+    def lean(self, row):
+        """Представление без тегов и ингредиентов прямо из строки."""
+        data = {field: row[field] for field in ('id', 'name', 'text',
+                                                'cooking_time')
+                if field in row}
+        if 'author_id' in row:
+            data['author'] = {
+                'id': row['author_id'],
+                **{field: row[f'author__{field}']
+                   for field in USER_FIELDS[1:]},
+            }
+        return data
+
+    def to_representation(self, rows):
+        recipe_ids = [row['id'] for row in rows]
+        selected = self.selected
+        if selected & self.cached_fields:
+            cached, tokens = RecipeRepresentationCache.get_many(recipe_ids)
+            missing = [row for row in rows if row['id'] not in cached]
+            if missing:
+                built = self.build(missing)
+                for recipe_id, data in built.items():
+                    RecipeRepresentationCache.set(recipe_id, data,
+                                                  tokens[recipe_id])
+                cached.update(built)
+        else:
+            cached = {row['id']: self.lean(row) for row in rows}
+
+        flags = selected & {'is_favorited', 'is_in_shopping_cart'}
+        if 'author' in selected:
+            flags.add('is_subscribed')
+        favorited, in_cart, subscribed = RecipeManager.viewer_flags(
+            self.user, recipe_ids,
+            {row['author_id'] for row in rows if 'author_id' in row}, flags)
+        result = []
+        for row in rows:
+            data = dict(cached[row['id']])
+            if 'author' in selected:
+                data['author'] = {
+                    **data['author'],
+                    'is_subscribed': row['author_id'] in subscribed,
+                }
+            data['is_favorited'] = row['id'] in favorited
+            data['is_in_shopping_cart'] = row['id'] in in_cart
+            if 'image' in selected:
+                data['image'] = image_url(self.request, row['image'])
+            result.append(data)
+        return result
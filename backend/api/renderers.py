@@ -0,0 +1,35 @@
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+from rest_framework.renderers import JSONRenderer
+
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                  if orjson else 0)
+
+
+class OrjsonRenderer(JSONRenderer):
+    """JSONRenderer на orjson с тем же побайтовым результатом.
+
+    Даты, Decimal, ленивые строки и прочие нестандартные типы
+    сериализует JSONEncoder DRF. Если orjson не установлен, запрошен
+    отступ или изменены настройки UNICODE_JSON/COMPACT_JSON, работает
+    стандартный JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii
+                or not self.compact
+                or self.get_indent(accepted_media_type,
+                                   renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default,
+                               option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # Например, целые за пределами 64 бит.
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+            b'\xe2\x80\xa9', b'\\u2029')
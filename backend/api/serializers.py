@@ -1,12 +1,19 @@
 from django.contrib.auth.models import User
+from django.db import models, transaction
 from djoser.serializers import (UserCreateSerializer as
                                 BaseUserRegistrationSerializer)
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
+from api.cache import RecipeRepresentationCache
+from api.changelog import ChangeLog
+from api.nutrition import NUTRIENTS, NutritionCalculator
+from api.similarity import MinHashIndex, NearDuplicates
 from api.utils import RecipeManager
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Subscription, Tag)
+from foodgram.profiling import segment
+from recipes.models import (ChangeLogEntry, Favorite, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, Subscription,
+                            Tag)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -19,6 +26,11 @@ class UserSerializer(serializers.ModelSerializer):
                   'email', 'is_subscribed']
 
     def get_is_subscribed(self, obj):
+        subscribed = getattr(self.parent, 'subscribed', None)
+        if subscribed is not None:
+            # Автор в RecipeSerializer: подписки загружены для всей
+            # страницы в prepare().
+            return obj.id in subscribed
         request = self.context.get('request')
         if (request
                 and hasattr(request, "user")
@@ -120,6 +132,17 @@ class CreateRecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
+class RecipeListSerializer(serializers.ListSerializer):
+
+    @segment('serializer')
+    def to_representation(self, data):
+        if isinstance(data, models.manager.BaseManager):
+            data = data.all()
+        recipes = list(data)
+        self.child.prepare(recipes)
+        return super().to_representation(recipes)
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
@@ -130,19 +153,51 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Recipe
-        fields = "__all__"
+        exclude = ('created_at', 'updated_at', 'duplicate_signature',
+                   *NUTRIENTS)
+        list_serializer_class = RecipeListSerializer
+
+    def prepare(self, recipes):
+        """Загружает из кэша представления рецептов и флаги текущего
+        пользователя сразу для всей страницы; автор, теги и ингредиенты
+        рецептов не из кэша подгружаются пачкой."""
+        self.cached, self.tokens = RecipeRepresentationCache.get_many(
+            [recipe.id for recipe in recipes])
+        models.prefetch_related_objects(
+            [recipe for recipe in recipes if recipe.id not in self.cached],
+            'author', 'tags', 'recipe_ingredients__ingredient')
+        self.favorited, self.in_cart, self.subscribed = (
+            RecipeManager.viewer_flags(
+                self.context.get('request').user,
+                [recipe.id for recipe in recipes],
+                {recipe.author_id for recipe in recipes}))
+
+    @segment('serializer')
+    def to_representation(self, instance):
+        if not hasattr(self, 'cached'):
+            self.prepare([instance])
+        data = self.cached.get(instance.id)
+        if data is None:
+            data = super().to_representation(instance)
+            RecipeRepresentationCache.set(instance.id, data,
+                                          self.tokens[instance.id])
+
+        request = self.context.get('request')
+        data = dict(data)
+        data['author'] = {
+            **data['author'],
+            'is_subscribed': instance.author_id in self.subscribed,
+        }
+        data['is_favorited'] = self.get_is_favorited(instance)
+        data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(instance)
+        data['image'] = request.build_absolute_uri(instance.image.url)
+        return data
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if user and not user.is_anonymous:
-            return Favorite.objects.filter(user=user, recipes=obj).exists()
-        return False
+        return obj.id in self.favorited
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        if user and not user.is_anonymous:
-            return ShoppingCart.objects.filter(user=user, recipes=obj).exists()
-        return False
+        return obj.id in self.in_cart
 
 
 class CreateRecipeSerializer(serializers.ModelSerializer):
@@ -194,6 +249,12 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
     def validate_image(self, value):
         return RecipeManager.validate_image(value)
 
+    @staticmethod
+    def nutrition(ingredients_data):
+        return NutritionCalculator.ingredient_totals(
+            [ingredient['id'] for ingredient in ingredients_data],
+            [ingredient['amount'] for ingredient in ingredients_data])
+
     def update_ingredients(self, recipe, ingredients_data):
         new_ingredients = [
             RecipeIngredient(
@@ -203,14 +264,29 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             ) for ingredient in ingredients_data
         ]
         RecipeIngredient.objects.bulk_create(new_ingredients)
-
+        # bulk_create не отправляет сигналы, поэтому дата изменения,
+        # кэш и журнал синхронизации обновляются явно.
+        RecipeManager.touch([recipe.id])
+        ChangeLog.record(ChangeLogEntry.RECIPE, [recipe.id])
+        MinHashIndex.index([recipe.id], [
+            (recipe.id, ingredient.ingredient_id)
+            for ingredient in new_ingredients])
+
+    @transaction.atomic
     def create(self, validated_data):
 
         cooking_time = validated_data.pop('cooking_time')
         ingredients_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
-        recipe = Recipe.objects.create(author=self.context['request'].user,
+        author = self.context['request'].user
+        signature = NearDuplicates.signature(
+            validated_data['name'],
+            [ingredient['id'].id for ingredient in ingredients_data])
+        self.duplicate_of = NearDuplicates.check(signature, author)
+        recipe = Recipe.objects.create(author=author,
                                        cooking_time=cooking_time,
+                                       duplicate_signature=signature,
+                                       **self.nutrition(ingredients_data),
                                        **validated_data)
 
         self.update_ingredients(recipe, ingredients_data)
@@ -219,10 +295,15 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
 
         ingredients_data = validated_data.pop('ingredients', None)
         tags_data = validated_data.pop('tags', None)
+        validated_data['duplicate_signature'] = NearDuplicates.signature(
+            validated_data.get('name', instance.name),
+            [ingredient['id'].id for ingredient in ingredients_data])
+        validated_data.update(self.nutrition(ingredients_data))
 
         instance = super().update(instance, validated_data)
         RecipeIngredient.objects.filter(recipe=instance).delete()
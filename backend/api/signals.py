@@ -0,0 +1,143 @@
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (ChangeLogEntry, Favorite, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, Subscription,
+                            Tag)
+from .authentication import TOKENS
+from .cache import AnonymousResponseCache, RecipeRepresentationCache
+from .changelog import ChangeLog
+from .nutrition import NutritionCalculator
+from .similarity import MinHashIndex, NearDuplicates
+from .utils import RecipeManager
+
+USER_PUBLIC_FIELDS = {'username', 'first_name', 'last_name', 'email'}
+# Промежуточная таблица → тип записи журнала и поле владельца.
+COLLECTIONS = {
+    Favorite.recipes.through: (ChangeLogEntry.FAVORITE, 'recipes'),
+    ShoppingCart.recipes.through: (ChangeLogEntry.SHOPPING_CART,
+                                   'recipes'),
+    Subscription.subscription.through: (ChangeLogEntry.SUBSCRIPTION,
+                                        'subscription'),
+}
+CATALOGS = {
+    Tag: ChangeLogEntry.TAG,
+    Ingredient: ChangeLogEntry.INGREDIENT,
+}
+
+
+def recipes_changed(recipe_ids):
+    """Изменение рецептов в обход Recipe.save(): дата изменения, кэш
+    и журнал синхронизации."""
+    recipe_ids = list(recipe_ids)
+    RecipeManager.touch(recipe_ids)
+    ChangeLog.record(ChangeLogEntry.RECIPE, recipe_ids)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def recipe_changed(sender, instance, signal, **kwargs):
+    RecipeRepresentationCache.invalidate([instance.id])
+    AnonymousResponseCache.invalidate_all()
+    ChangeLog.record(ChangeLogEntry.RECIPE, [instance.id],
+                     deleted=signal is post_delete)
+    if signal is post_save:
+        NearDuplicates.refresh_signatures([instance.id])
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Recipe):
+        return
+    # Массовое удаление делает CreateRecipeSerializer.update, который
+    # сам считает пищевую ценность и полосы LSH нового состава и пишет
+    # в журнал; touch в его транзакции обновит рецепт один раз.
+    if isinstance(origin, QuerySet):
+        RecipeManager.touch([instance.recipe_id])
+        return
+    recipes_changed([instance.recipe_id])
+    NutritionCalculator.refresh_later([instance.recipe_id])
+    MinHashIndex.reindex([instance.recipe_id])
+    NearDuplicates.refresh_signatures([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    if reverse and action == 'pre_clear':
+        recipes_changed(
+            instance.tagged_recipes.values_list('id', flat=True))
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        recipes_changed([instance.id])
+    elif pk_set:
+        recipes_changed(pk_set)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=Ingredient)
+def catalog_changed(sender, instance, signal, **kwargs):
+    """Тег или ингредиент входит в представление множества рецептов,
+    поэтому рецепты не обновляются по одному: кэши сбрасываются сменой
+    поколения, а запись справочника в журнале меняет ETag списков
+    и рецептов и попадает в синхронизацию."""
+    RecipeRepresentationCache.invalidate_all()
+    AnonymousResponseCache.invalidate_all()
+    ChangeLog.record(CATALOGS[sender], [instance.id],
+                     deleted=signal is post_delete)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_nutrition_changed(sender, instance, **kwargs):
+    NutritionCalculator.ingredients_changed([instance.id])
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not USER_PUBLIC_FIELDS & set(update_fields):
+        return
+    recipes_changed(
+        Recipe.objects.filter(author=instance).values_list('id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Token)
+def token_changed(sender, instance, **kwargs):
+    TOKENS.invalidate([instance.key])
+
+
+@receiver(post_save, sender=User)
+def user_tokens_changed(sender, instance, update_fields=None, **kwargs):
+    # Вход обновляет только last_login, на проверку токена он не влияет.
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    TOKENS.invalidate(
+        Token.objects.filter(user=instance).values_list('key', flat=True))
+
+
+@receiver(m2m_changed, sender=Favorite.recipes.through)
+@receiver(m2m_changed, sender=ShoppingCart.recipes.through)
+@receiver(m2m_changed, sender=Subscription.subscription.through)
+def collection_changed(sender, instance, action, reverse, model, pk_set,
+                       **kwargs):
+    """Избранное, корзина и подписки попадают в журнал владельца."""
+    kind, field_name = COLLECTIONS[sender]
+    if action == 'pre_clear':
+        # После очистки pk_set пуст, поэтому состав запоминаем заранее.
+        related = (model.objects.filter(**{field_name: instance})
+                   if reverse else getattr(instance, field_name))
+        instance._cleared_pks = set(related.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_pks', set())
+    elif action not in ('post_add', 'post_remove'):
+        return
+    deleted = action != 'post_add'
+    if not reverse:
+        ChangeLog.record(kind, pk_set, instance.user_id, deleted)
+        return
+    for user_id in model.objects.filter(pk__in=pk_set).values_list(
+            'user_id', flat=True):
+        ChangeLog.record(kind, [instance.pk], user_id, deleted)
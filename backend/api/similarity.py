@@ -0,0 +1,229 @@
+import hashlib
+import re
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, IntegerField, Value, When
+from rest_framework import serializers
+
+from recipes.models import Recipe, RecipeIngredient, RecipeSimilarityBand
+from .transactions import OnCommitBuffer
+
+# Простое число больше 2**32: (a * x + b) % PRIME для идентификаторов
+# ингредиентов не выходит за uint64.
+PRIME = 4294967311
+WORD = re.compile(r'[^\W\d_]+')
+
+
+@lru_cache
+def hash_parameters(seed, bands, rows):
+    rng = np.random.default_rng(seed)
+    size = bands * rows
+    return (rng.integers(1, PRIME, size, dtype=np.uint64),
+            rng.integers(0, PRIME, size, dtype=np.uint64),
+            rng.integers(1, 2 ** 63, rows, dtype=np.uint64) | np.uint64(1))
+
+
+class MinHashIndex:
+    """Поиск рецептов с похожим набором ингредиентов.
+
+    Подпись рецепта — минимумы BANDS * ROWS универсальных хеш-функций
+    по идентификаторам его ингредиентов; доля совпавших значений двух
+    подписей оценивает коэффициент Жаккара. Подпись режется на полосы
+    по ROWS значений, каждая полоса хранится одним числом в
+    RecipeSimilarityBand. Рецепты, у которых совпала хотя бы одна
+    полоса, становятся кандидатами и ранжируются по точному
+    коэффициенту Жаккара, так что запрос не зависит от числа рецептов.
+
+    Хеш-функции задаются SIMILAR_RECIPES_SEED, поэтому подписи
+    build_similarity_index и инкрементальных обновлений совместимы.
+    Индекс пишется только при изменении рецепта и командой
+    build_similarity_index; чтение похожих его не меняет.
+    """
+
+    @staticmethod
+    def parameters():
+        return hash_parameters(settings.SIMILAR_RECIPES_SEED,
+                               settings.SIMILAR_RECIPES_BANDS,
+                               settings.SIMILAR_RECIPES_ROWS)
+
+    @classmethod
+    def buckets(cls, recipe_ids, ingredient_ids):
+        """Номера корзин LSH для пар (рецепт, ингредиент), отсортированных
+        по рецепту: массив формы (число рецептов, BANDS)."""
+        multipliers, offsets, mixers = cls.parameters()
+        recipe_ids = np.asarray(recipe_ids)
+        ingredient_ids = np.asarray(ingredient_ids, dtype=np.uint64)
+        hashes = (ingredient_ids[:, None] * multipliers + offsets) % PRIME
+        starts = np.flatnonzero(np.r_[True, recipe_ids[1:] != recipe_ids[:-1]])
+        signatures = np.minimum.reduceat(hashes, starts, axis=0)
+        bands = signatures.reshape(
+            len(starts), settings.SIMILAR_RECIPES_BANDS, -1)
+        # Переполнение uint64 при смешивании ожидаемо; сдвиг оставляет
+        # 63 бита, чтобы значение поместилось в BigIntegerField.
+        return recipe_ids[starts], (
+            (bands * mixers).sum(axis=2) >> np.uint64(1)).astype(np.int64)
+
+    @classmethod
+    def index(cls, recipe_ids, pairs=None):
+        """Пересчитывает полосы рецептов. pairs — отсортированные по
+        рецепту пары (рецепт, ингредиент), иначе берутся из базы."""
+        recipe_ids = list(recipe_ids)
+        if pairs is None:
+            pairs = (RecipeIngredient.objects
+                     .filter(recipe_id__in=recipe_ids)
+                     .order_by('recipe_id')
+                     .values_list('recipe_id', 'ingredient_id'))
+        pairs = np.array(list(pairs), dtype=np.int64).reshape(-1, 2)
+        bands = []
+        if len(pairs):
+            indexed, buckets = cls.buckets(pairs[:, 0], pairs[:, 1])
+            bands = [
+                RecipeSimilarityBand(recipe_id=recipe_id, band=band,
+                                     bucket=bucket)
+                for recipe_id, row in zip(indexed.tolist(), buckets.tolist())
+                for band, bucket in enumerate(row)
+            ]
+        with transaction.atomic():
+            RecipeSimilarityBand.objects.filter(
+                recipe_id__in=recipe_ids).delete()
+            RecipeSimilarityBand.objects.bulk_create(bands)
+        return bands
+
+    pending = OnCommitBuffer(index)
+
+    @classmethod
+    def reindex(cls, recipe_ids):
+        """Пересчитывает полосы рецептов после фиксации транзакции,
+        по одному разу на рецепт."""
+        cls.pending.add(dict.fromkeys(recipe_ids))
+
+    @classmethod
+    def similar(cls, recipe_id, limit):
+        """Список (id рецепта, коэффициент Жаккара) по убыванию сходства."""
+        bands = list(RecipeSimilarityBand.objects.filter(
+            recipe_id=recipe_id).values_list('band', 'bucket'))
+        if not bands:
+            # Рецепт ещё не попал в индекс (например, база заполнена
+            # до build_similarity_index).
+            return []
+        # Каждая полоса даёт не больше CANDIDATES рецептов: корзины
+        # популярных сочетаний растут вместе с базой, а запрос — нет.
+        per_band = [
+            RecipeSimilarityBand.objects.filter(band=band, bucket=bucket)
+            .exclude(recipe_id=recipe_id)
+            .values_list('recipe_id', flat=True)
+            [:settings.SIMILAR_RECIPES_CANDIDATES]
+            for band, bucket in bands
+        ]
+        # Не все СУБД разрешают LIMIT внутри UNION, поэтому каждая
+        # полоса оборачивается в подзапрос.
+        parts = [query.query.sql_with_params() for query in per_band]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                ' UNION ALL '.join(
+                    f'SELECT * FROM ({sql}) AS band_{number}'
+                    for number, (sql, _) in enumerate(parts)),
+                [param for _, params in parts for param in params])
+            matches = Counter(row[0] for row in cursor.fetchall())
+        candidates = [candidate_id for candidate_id, _ in sorted(
+            matches.items(), key=lambda match: (-match[1], match[0]))
+            [:settings.SIMILAR_RECIPES_CANDIDATES]]
+        if not candidates:
+            return []
+
+        ingredients = {}
+        for candidate_id, ingredient_id in RecipeIngredient.objects.filter(
+                recipe_id__in=[recipe_id, *candidates]).values_list(
+                'recipe_id', 'ingredient_id'):
+            ingredients.setdefault(candidate_id, set()).add(ingredient_id)
+        target = ingredients.get(recipe_id, set())
+        scores = []
+        for candidate_id in candidates:
+            other = ingredients.get(candidate_id, set())
+            if target | other:
+                scores.append((candidate_id,
+                               len(target & other) / len(target | other)))
+        scores.sort(key=lambda score: (-score[1], score[0]))
+        return scores[:limit]
+
+
+class NearDuplicates:
+    """Поиск повторно опубликованных рецептов.
+
+    Сигнатура — md5 от набора ингредиентов и набора слов названия без
+    учёта регистра, порядка слов, цифр и знаков препинания. Рецепты,
+    отличающиеся количествами, текстом, временем приготовления или
+    номером в названии, получают одну сигнатуру, и проверка при
+    создании сводится к одному запросу по индексу. Более далёкие
+    дубликаты ищет команда find_duplicate_recipes.
+    """
+
+    @staticmethod
+    def words(name):
+        return sorted(set(WORD.findall(name.lower().replace('ё', 'е'))))
+
+    @classmethod
+    def shingles(cls, name, size=3):
+        text = ' '.join(cls.words(name))
+        return {text[start:start + size]
+                for start in range(max(len(text) - size + 1, 1))}
+
+    @classmethod
+    def signature(cls, name, ingredient_ids):
+        key = (','.join(map(str, sorted(set(ingredient_ids)))) + '|'
+               + ' '.join(cls.words(name)))
+        return hashlib.md5(key.encode()).hexdigest()
+
+    @classmethod
+    def update_signatures(cls, recipe_ids):
+        """Пересчитывает сохранённые сигнатуры рецептов по текущим
+        названию и составу."""
+        recipes = list(Recipe.objects.filter(id__in=list(recipe_ids))
+                       .only('id', 'name', 'duplicate_signature'))
+        ingredients = {recipe.id: [] for recipe in recipes}
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+                recipe_id__in=ingredients).values_list(
+                'recipe_id', 'ingredient_id'):
+            ingredients[recipe_id].append(ingredient_id)
+        changed = []
+        for recipe in recipes:
+            signature = cls.signature(recipe.name, ingredients[recipe.id])
+            if signature != recipe.duplicate_signature:
+                recipe.duplicate_signature = signature
+                changed.append(recipe)
+        Recipe.objects.bulk_update(changed, ['duplicate_signature'])
+
+    pending = OnCommitBuffer(update_signatures)
+
+    @classmethod
+    def refresh_signatures(cls, recipe_ids):
+        """Пересчитывает сигнатуры рецептов после фиксации транзакции,
+        по одному разу на рецепт: правки в админке идут в обход
+        CreateRecipeSerializer."""
+        cls.pending.add(dict.fromkeys(recipe_ids))
+
+    @staticmethod
+    def check(signature, author):
+        """Возвращает id похожего рецепта, если его разрешено сохранить,
+        или отклоняет новый рецепт согласно DUPLICATE_*_ACTION."""
+        duplicate = (
+            Recipe.objects.filter(duplicate_signature=signature)
+            .order_by(Case(When(author=author, then=Value(0)),
+                           default=Value(1), output_field=IntegerField()))
+            .values_list('id', 'author_id').first())
+        if duplicate is None:
+            return None
+        recipe_id, author_id = duplicate
+        if author_id == author.id:
+            action = settings.DUPLICATE_OWN_RECIPE_ACTION
+            message = f'У вас уже есть такой рецепт (id {recipe_id}).'
+        else:
+            action = settings.DUPLICATE_RECIPE_ACTION
+            message = f'Такой рецепт уже опубликован (id {recipe_id}).'
+        if action == 'reject':
+            raise serializers.ValidationError({'duplicate_of': message})
+        return recipe_id if action == 'warn' else None
@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from api.changelog import ChangeLog
+from recipes.models import ChangeLogEntry, Favorite, Recipe, Tag
+
+
+class ChangeLogTest(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_one_entry_per_object_per_transaction(self):
+        with transaction.atomic():
+            recipe = Recipe.objects.create(author=self.user, name='Суп',
+                                           cooking_time=5)
+            ChangeLog.record(ChangeLogEntry.RECIPE, [recipe.id])
+            recipe.save()
+            self.assertFalse(ChangeLogEntry.objects.exists())
+        self.assertEqual(
+            list(ChangeLogEntry.objects.values_list('object_id', 'deleted')),
+            [(recipe.id, False)])
+
+    def test_recent_entries_are_held_back(self):
+        recipe = Recipe.objects.create(author=self.user, name='Суп',
+                                       cooking_time=5)
+        cursor = ChangeLogEntry.objects.get().id
+        Favorite.objects.create(user=self.user).recipes.add(recipe)
+
+        with override_settings(SYNC_SAFETY_LAG=60):
+            data = self.client.get('/api/sync/', {'since': cursor}).json()
+            self.assertEqual((data['cursor'], data['favorites']['added']),
+                             (cursor, []))
+            # Запись о рецепте тоже свежая: курсор стоит перед ней.
+            self.assertEqual(self.client.get('/api/sync/').json()['cursor'],
+                             cursor - 1)
+        with override_settings(SYNC_SAFETY_LAG=0):
+            data = self.client.get('/api/sync/', {'since': cursor}).json()
+            self.assertEqual(data['favorites']['added'], [recipe.id])
+            self.assertGreater(data['cursor'], cursor)
+
+    @override_settings(SYNC_SAFETY_LAG=0)
+    def test_catalog_change_recorded_once(self):
+        tag = Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        recipe = Recipe.objects.create(author=self.user, name='Суп',
+                                       cooking_time=5)
+        recipe.tags.add(tag)
+        cursor = ChangeLogEntry.objects.latest('id').id
+        etag = self.client.get('/api/recipes/')['ETag']
+
+        tag.name = 'Второе'
+        tag.save()
+        self.assertEqual(
+            list(ChangeLogEntry.objects.filter(id__gt=cursor).values_list(
+                'kind', 'object_id')), [(ChangeLogEntry.TAG, tag.id)])
+        data = self.client.get('/api/sync/', {'since': cursor}).json()
+        self.assertEqual(data['tags']['upserted'][0]['name'], 'Второе')
+        self.assertEqual(data['recipes']['upserted'], [])
+        response = self.client.get('/api/recipes/')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['tags'][0]['name'],
+                         'Второе')
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+from foodgram.middleware import CompressionMiddleware
+
+PAGE = b'<html>' + b'csrfmiddlewaretoken ' * 200 + b'</html>'
+
+
+class CompressionTest(SimpleTestCase):
+
+    def respond(self, path, **headers):
+        def get_response(request):
+            response = HttpResponse(PAGE, content_type='text/html')
+            for name, value in headers.items():
+                response[name] = value
+            return response
+
+        request = RequestFactory().get(path, HTTP_ACCEPT_ENCODING='gzip')
+        return CompressionMiddleware(get_response)(request)
+
+    def test_compresses_public_page(self):
+        self.assertEqual(self.respond('/api/docs/')['Content-Encoding'],
+                         'gzip')
+
+    def test_skips_pages_exposed_to_breach(self):
+        responses = {
+            'админка': self.respond('/admin/login/'),
+            'Vary: Cookie': self.respond('/api/docs/', Vary='Cookie'),
+        }
+        response = HttpResponse(PAGE, content_type='text/html')
+        response.set_cookie(settings.CSRF_COOKIE_NAME, 'token')
+        responses['cookie CSRF'] = CompressionMiddleware(
+            lambda request: response)(RequestFactory().get(
+                '/api/docs/', HTTP_ACCEPT_ENCODING='gzip'))
+        for case, response in responses.items():
+            with self.subTest(case=case):
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertEqual(response.content, PAGE)
@@ -0,0 +1,32 @@
+import os
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api.invalidation import InvalidationBus
+
+
+class Stop(BaseException):
+    """Останавливает бесконечный цикл слушателя в тесте."""
+
+
+class InvalidationBusTest(SimpleTestCase):
+
+    def test_bad_message_resets_caches(self):
+        with mock.patch.object(InvalidationBus, 'reset') as reset, \
+                self.assertLogs('foodgram.invalidation', 'ERROR'):
+            InvalidationBus.receive('{"name": "tokens"}')
+            InvalidationBus.receive('не json')
+        self.assertEqual(reset.call_count, 2)
+
+    @mock.patch('api.invalidation.time.sleep', side_effect=Stop)
+    def test_listener_error_stops_listening(self, sleep):
+        connection = mock.MagicMock()
+        connection.__enter__.return_value.notifies.side_effect = KeyError
+        with mock.patch('api.invalidation.psycopg.connect',
+                        return_value=connection), \
+                mock.patch.object(InvalidationBus, 'reset'), \
+                self.assertLogs('foodgram.invalidation', 'ERROR'), \
+                self.assertRaises(Stop):
+            InvalidationBus.run()
+        self.assertNotEqual(InvalidationBus.listening_pid, os.getpid())
@@ -0,0 +1,95 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from api.nutrition import NutritionCalculator
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+
+
+class MaxCaloriesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author')
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г',
+                                          calories=400, proteins=0, fats=0,
+                                          carbohydrates=100)
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        cls.known, cls.unknown = (
+            Recipe.objects.create(author=author, name=name, cooking_time=5)
+            for name in ('Сахар', 'Сахар с солью'))
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=cls.known, ingredient=sugar, amount=50),
+            RecipeIngredient(recipe=cls.unknown, ingredient=sugar,
+                             amount=50),
+            RecipeIngredient(recipe=cls.unknown, ingredient=salt, amount=5),
+        ])
+        NutritionCalculator.refresh([cls.known.id, cls.unknown.id])
+
+    def test_unknown_ingredient_makes_totals_unknown(self):
+        self.known.refresh_from_db()
+        self.unknown.refresh_from_db()
+        self.assertEqual(self.known.calories, 200)
+        self.assertIsNone(self.unknown.calories)
+
+    def test_filter_excludes_unknown(self):
+        response = APIClient().get('/api/recipes/', {'max_calories': 1000})
+        self.assertEqual([recipe['id'] for recipe
+                          in response.json()['results']], [self.known.id])
+
+    def test_invalid_threshold_rejected(self):
+        for value in ('-1', 'nan', 'inf', 'много'):
+            with self.subTest(value=value):
+                response = APIClient().get('/api/recipes/',
+                                           {'max_calories': value})
+                self.assertEqual(response.status_code, 400)
+
+
+class IngredientChangeTest(TransactionTestCase):
+    """Рецепты пересчитываются после фиксации изменения ингредиента."""
+
+    @override_settings(NUTRITION_REFRESH_BATCH_SIZE=1)
+    def test_recipes_refreshed_in_batches_after_commit(self):
+        author = User.objects.create_user(username='author')
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        recipes = [Recipe.objects.create(author=author, name=f'Рецепт {index}',
+                                         cooking_time=5)
+                   for index in range(3)]
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=salt,
+                             amount=10 * (index + 1))
+            for index, recipe in enumerate(recipes))
+
+        with transaction.atomic():
+            salt.calories = 100
+            salt.save()
+            self.assertIsNone(Recipe.objects.get(id=recipes[0].id).calories)
+
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list('calories',
+                                                           flat=True)),
+            [10, 20, 30])
+
+    def test_recipe_rows_refreshed_once_after_commit(self):
+        author = User.objects.create_user(username='author')
+        sugar, flour = (
+            Ingredient.objects.create(name=name, measurement_unit='г',
+                                      calories=calories)
+            for name, calories in (('сахар', 400), ('мука', 300)))
+        recipe = Recipe.objects.create(author=author, name='Пирог',
+                                       cooking_time=5)
+        # Как при сохранении строк RecipeIngredientInline в админке.
+        with mock.patch.object(NutritionCalculator, 'save',
+                               wraps=NutritionCalculator.save) as save:
+            with transaction.atomic():
+                for ingredient, amount in ((sugar, 50), (flour, 100)):
+                    RecipeIngredient.objects.create(
+                        recipe=recipe, ingredient=ingredient, amount=amount)
+                recipe.refresh_from_db()
+                self.assertIsNone(recipe.calories)
+        self.assertEqual(save.call_count, 1)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.calories, 500)
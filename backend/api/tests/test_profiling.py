@@ -0,0 +1,27 @@
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from foodgram.middleware import QueryCounter
+from foodgram.profiling import observe_queries
+from recipes.models import Tag
+
+
+class RequestProfilingTest(TransactionTestCase):
+
+    def test_queries_in_pool_threads_observed(self):
+        count = sync_to_async(Tag.objects.count, thread_sensitive=False)
+        with observe_queries(QueryCounter()) as counter:
+            async_to_sync(count)()
+        self.assertEqual(counter.count, 1)
+
+    @override_settings(REQUEST_PROFILING=True,
+                       REQUEST_PROFILING_SAMPLE_RATE=1)
+    def test_server_timing_has_serializer_segment(self):
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+        with self.assertLogs('foodgram.requests') as logs:
+            response = APIClient().get('/api/tags/')
+        self.assertIn('"serializer_ms"', logs.output[0])
+        timing = response['Server-Timing']
+        self.assertIn('desc="1 queries"', timing)
+        self.assertIn('serializer;dur=', timing)
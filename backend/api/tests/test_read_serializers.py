@@ -0,0 +1,238 @@
+import random
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.cache import RecipeRepresentationCache
+from api.invalidation import InvalidationBus
+from api.read_serializers import (IngredientReadSerializer,
+                                  RecipeReadSerializer,
+                                  SubscriptionReadSerializer,
+                                  TagReadSerializer, UserReadSerializer)
+from api.renderers import OrjsonRenderer
+from api.serializers import (IngredientSerializer, RecipeSerializer,
+                             SubscriptionSerializer, TagSerializer,
+                             UserSerializer)
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Subscription, Tag)
+from .utils import isolated_cache
+
+# Случайные данные и выборки воспроизводимы: при расхождении
+# subTest называет номер примера.
+SEED = 1983
+SAMPLES = 100
+
+
+class SameOutputMixin:
+    """Эталон — ModelSerializer на пустом кэше представлений; лёгкий
+    сериализатор сверяется с ним на пустом кэше и на кэше, заполненном
+    им самим, а ModelSerializer — на кэше, заполненном лёгким."""
+
+    def setUp(self):
+        cache.clear()
+
+    def context(self, user, **params):
+        request = Request(APIRequestFactory().get('/api/', params))
+        request.user = user
+        return {'request': request}
+
+    def assertSameOutput(self, serializer, read_serializer, queryset,
+                         context, many=True):
+        cache.clear()
+        expected = OrjsonRenderer().render(serializer(
+            queryset if many else queryset.first(), many=many,
+            context=context).data)
+        cache.clear()
+        for _ in ('пустой кэш', 'свой кэш'):
+            rows = read_serializer.values(queryset)
+            actual = read_serializer(rows if many else rows.first(),
+                                     many=many, context=context).data
+            self.assertEqual(OrjsonRenderer().render(actual), expected)
+        actual = serializer(queryset if many else queryset.first(),
+                            many=many, context=context).data
+        self.assertEqual(OrjsonRenderer().render(actual), expected)
+
+
+@isolated_cache
+class ReadSerializersTest(SameOutputMixin, TestCase):
+    """Лёгкие сериализаторы совпадают с ModelSerializer на заданных
+    данных."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer, cls.author, cls.other = (
+            User.objects.create_user(username=name, email=f'{name}@a.ru',
+                                     first_name=name, last_name='Тест')
+            for name in ('viewer', 'author', 'other'))
+        tags = [Tag.objects.create(name=f'Тег {index}', slug=f'tag{index}',
+                                   color=f'#00000{index}')
+                for index in range(3)]
+        ingredients = [Ingredient.objects.create(
+            name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(4)]
+        cls.recipes = []
+        for index, author in enumerate((cls.author, cls.author, cls.other)):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {index}', text='Текст',
+                cooking_time=10 + index)
+            recipe.tags.set(tags[index:])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=50 * (position + 1))
+                for position, ingredient in enumerate(ingredients[index:]))
+            cls.recipes.append(recipe)
+        Favorite.objects.create(user=cls.viewer).recipes.add(cls.recipes[0])
+        ShoppingCart.objects.create(user=cls.viewer).recipes.add(
+            cls.recipes[1])
+        Subscription.objects.create(user=cls.viewer).subscription.add(
+            cls.author)
+
+    def test_recipes(self):
+        queryset = Recipe.objects.order_by('-id')
+        for user in (self.viewer, self.other, AnonymousUser()):
+            with self.subTest(user=user):
+                self.assertSameOutput(RecipeSerializer,
+                                      RecipeReadSerializer, queryset,
+                                      self.context(user))
+
+    def test_single_recipe(self):
+        self.assertSameOutput(
+            RecipeSerializer, RecipeReadSerializer,
+            Recipe.objects.filter(id=self.recipes[0].id),
+            self.context(self.viewer), many=False)
+
+    def test_users(self):
+        queryset = User.objects.order_by('id')
+        for user in (self.viewer, AnonymousUser()):
+            with self.subTest(user=user):
+                self.assertSameOutput(UserSerializer, UserReadSerializer,
+                                      queryset, self.context(user))
+
+    def test_subscriptions(self):
+        queryset = User.objects.filter(
+            id__in=[self.author.id, self.other.id]).order_by('id')
+        for params in ({}, {'recipes_limit': 1}):
+            with self.subTest(params=params):
+                self.assertSameOutput(
+                    SubscriptionSerializer, SubscriptionReadSerializer,
+                    queryset, self.context(self.viewer, **params))
+
+
+@isolated_cache
+class RandomizedReadSerializersTest(SameOutputMixin, TestCase):
+    """Лёгкие сериализаторы совпадают с ModelSerializer на случайных
+    данных, выборках объектов, пользователях и параметрах запроса."""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(SEED)
+        users = [User.objects.create_user(
+            username=f'user{index}', email=f'user{index}@a.ru',
+            first_name=f'Имя {index}', last_name=f'Фамилия {index}')
+            for index in range(6)]
+        tags = [Tag.objects.create(name=f'Тег {index}', slug=f'tag{index}',
+                                   color=f'#0000{index:02}')
+                for index in range(5)]
+        ingredients = [Ingredient.objects.create(
+            name=f'Ингредиент {index}', measurement_unit=rng.choice(
+                ('г', 'мл', 'шт.')))
+            for index in range(10)]
+        recipes = []
+        for index in range(20):
+            recipe = Recipe.objects.create(
+                author=rng.choice(users), name=f'Рецепт {index}',
+                text=f'Текст {index}', cooking_time=rng.randint(1, 120))
+            recipe.tags.set(rng.sample(tags, rng.randint(0, len(tags))))
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=rng.randint(1, 1000))
+                for ingredient in rng.sample(
+                    ingredients, rng.randint(0, len(ingredients))))
+            recipes.append(recipe)
+        for user in users:
+            Favorite.objects.create(user=user).recipes.set(
+                rng.sample(recipes, rng.randint(0, 5)))
+            ShoppingCart.objects.create(user=user).recipes.set(
+                rng.sample(recipes, rng.randint(0, 5)))
+            Subscription.objects.create(user=user).subscription.set(
+                rng.sample([author for author in users if author != user],
+                           rng.randint(0, 3)))
+
+    def test_random_samples(self):
+        rng = random.Random(SEED)
+        cases = (
+            (RecipeSerializer, RecipeReadSerializer, Recipe.objects),
+            (UserSerializer, UserReadSerializer, User.objects),
+            (SubscriptionSerializer, SubscriptionReadSerializer,
+             User.objects),
+            (TagSerializer, TagReadSerializer, Tag.objects),
+            (IngredientSerializer, IngredientReadSerializer,
+             Ingredient.objects),
+        )
+        users = [*User.objects.order_by('id'), AnonymousUser()]
+        for sample in range(SAMPLES):
+            serializer, read_serializer, manager = rng.choice(cases)
+            ids = list(manager.order_by('id').values_list('id', flat=True))
+            chosen = rng.sample(ids, rng.randint(1, len(ids)))
+            many = len(chosen) > 1 or rng.random() < 0.5
+            queryset = manager.filter(id__in=chosen).order_by(
+                rng.choice(('id', '-id')))
+            params = {}
+            if rng.random() < 0.5:
+                params['recipes_limit'] = rng.randint(1, 5)
+            user = rng.choice(users)
+            with self.subTest(sample=sample, serializer=serializer.__name__):
+                self.assertSameOutput(serializer, read_serializer, queryset,
+                                      self.context(user, **params), many)
+
+
+@isolated_cache
+class RepresentationInvalidationTest(TransactionTestCase):
+    """Сброс кэша представлений выполняется после фиксации транзакции,
+    поэтому проверяется на настоящих транзакциях."""
+
+    def test_recipe_change_is_visible(self):
+        user = User.objects.create_user(username='author')
+        recipe = Recipe.objects.create(author=user, name='Старое название',
+                                       cooking_time=5)
+        cache.clear()
+        request = Request(APIRequestFactory().get('/api/'))
+        request.user = user
+        context = {'request': request}
+        queryset = Recipe.objects.filter(id=recipe.id)
+        RecipeReadSerializer(RecipeReadSerializer.values(queryset),
+                             many=True, context=context).data
+
+        with transaction.atomic():
+            recipe.name = 'Новое название'
+            recipe.save()
+
+        for data in (
+            RecipeSerializer(queryset, many=True, context=context).data,
+            RecipeReadSerializer(RecipeReadSerializer.values(queryset),
+                                 many=True, context=context).data,
+        ):
+            self.assertEqual(data[0]['name'], 'Новое название')
+
+    def test_build_before_eviction_not_cached(self):
+        cached, tokens = RecipeRepresentationCache.get_many([1])
+        self.assertEqual(cached, {})
+        RecipeRepresentationCache.evict([1])
+        RecipeRepresentationCache.set(1, {'name': 'Старое'}, tokens[1])
+        cached, tokens = RecipeRepresentationCache.get_many([1])
+        self.assertEqual(cached, {})
+        RecipeRepresentationCache.set(1, {'name': 'Новое'}, tokens[1])
+        self.assertEqual(RecipeRepresentationCache.get_many([1])[0],
+                         {1: {'name': 'Новое'}})
+
+    def test_process_cache_unused_without_listener(self):
+        with mock.patch.object(InvalidationBus, 'listening',
+                               return_value=False):
+            cached, tokens = RecipeRepresentationCache.get_many([1])
+            RecipeRepresentationCache.set(1, {'name': 'Рецепт'}, tokens[1])
+            self.assertEqual(RecipeRepresentationCache.get_many([1])[0], {})
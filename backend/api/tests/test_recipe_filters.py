@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import Recipe
+
+
+class RecipeFiltersTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author')
+        cls.quick, cls.slow = (
+            Recipe.objects.create(author=author, name=name,
+                                  cooking_time=cooking_time)
+            for name, cooking_time in (('Быстрый', 5), ('Долгий', 90)))
+
+    def ids(self, **params):
+        response = APIClient().get('/api/recipes/', params)
+        return sorted(recipe['id'] for recipe in response.json()['results'])
+
+    def test_range_filters(self):
+        self.assertEqual(self.ids(cooking_time_max=30), [self.quick.id])
+        self.assertEqual(self.ids(cooking_time_min=30), [self.slow.id])
+        self.assertEqual(self.ids(created_after='2000-01-01'),
+                         [self.quick.id, self.slow.id])
+        self.assertEqual(self.ids(created_after='2999-01-01T00:00:00'), [])
+
+    def test_invalid_values_rejected(self):
+        for param, value in (('cooking_time_min', 'час'),
+                             ('cooking_time_max', '-5'),
+                             ('cooking_time_max', '1.5'),
+                             ('created_after', 'вчера'),
+                             ('created_after', '2024-13-01')):
+            with self.subTest(param=param, value=value):
+                response = APIClient().get('/api/recipes/', {param: value})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(param, response.json())
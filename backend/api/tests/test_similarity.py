@@ -0,0 +1,54 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TransactionTestCase
+from rest_framework.test import APIClient
+
+from api.similarity import NearDuplicates
+from recipes.models import (Ingredient, Recipe, RecipeIngredient,
+                            RecipeSimilarityBand)
+
+
+class SimilarRecipesTest(TransactionTestCase):
+
+    def setUp(self):
+        author = User.objects.create_user(username='author')
+        self.salt, self.flour = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'мука'))
+        self.first, self.second = (
+            Recipe.objects.create(author=author, name=name, cooking_time=5)
+            for name in ('Хлеб', 'Лепёшка'))
+
+    def test_similar_does_not_index(self):
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=self.first, ingredient=self.salt,
+                             amount=5)])
+        response = APIClient().get(f'/api/recipes/{self.first.id}/similar/')
+        self.assertEqual(response.json(), [])
+        self.assertFalse(RecipeSimilarityBand.objects.exists())
+
+    def test_ingredient_rows_reindex_once_after_commit(self):
+        with transaction.atomic():
+            for recipe in (self.first, self.second):
+                for ingredient in (self.salt, self.flour):
+                    RecipeIngredient.objects.create(
+                        recipe=recipe, ingredient=ingredient, amount=5)
+            self.assertFalse(RecipeSimilarityBand.objects.exists())
+        response = APIClient().get(f'/api/recipes/{self.first.id}/similar/')
+        self.assertEqual(response.json()[0]['id'], self.second.id)
+        self.assertEqual(response.json()[0]['similarity'], 1)
+
+    def test_admin_edits_refresh_duplicate_signature(self):
+        # Как правка в RecipeAdmin: название и строки ингредиентов
+        # сохраняются в обход CreateRecipeSerializer.
+        with transaction.atomic():
+            self.second.name = 'Хлеб'
+            self.second.save()
+            RecipeIngredient.objects.create(
+                recipe=self.second, ingredient=self.salt, amount=5)
+        RecipeIngredient.objects.create(
+            recipe=self.first, ingredient=self.salt, amount=10)
+        expected = NearDuplicates.signature('Хлеб', [self.salt.id])
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'duplicate_signature', flat=True)), [expected, expected])
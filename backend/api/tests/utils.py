@@ -0,0 +1,23 @@
+from unittest import mock
+
+from django.test import override_settings
+
+from api.invalidation import InvalidationBus
+
+# Оба сериализатора пишут в RecipeRepresentationCache и читают из него;
+# на общем кэше тесты сравнивали бы данные друг друга. Сверка идёт
+# на отдельном кэше процесса, который очищается без рассылки сброса.
+ISOLATED_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'read-serializers-tests',
+    },
+}
+
+
+def isolated_cache(test):
+    """Отдельный кэш процесса, который используется так, будто
+    слушатель InvalidationBus подписан на канал."""
+    test = mock.patch.object(InvalidationBus, 'listening',
+                             new=mock.Mock(return_value=True))(test)
+    return override_settings(CACHES=ISOLATED_CACHES)(test)
@@ -0,0 +1,76 @@
+import math
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from foodgram.metrics import REJECTED_REQUESTS
+
+
+class ActionTokenBucketThrottle(SimpleRateThrottle):
+    """Token bucket для отдельных действий DRF.
+
+    Действие получает scope из throttle_scopes представления или из его
+    метода get_throttle_scope(); частота берётся из
+    DEFAULT_THROTTLE_RATES, None отключает ограничение. Ведро вмещает
+    всю частоту: при '10/min' можно сделать десять запросов подряд,
+    затем по одному в шесть секунд. Ведро авторизованного пользователя
+    привязано к нему, анонимного — к IP.
+
+    Состояние ведра — одно число в кэше (теоретическое время прибытия
+    следующего запроса, GCRA). Как и у остальных throttle-классов DRF,
+    чтение и запись не атомарны, поэтому при гонке ведро может
+    пропустить лишний запрос.
+    """
+
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def __init__(self):
+        # Частота зависит от действия и определяется в allow_request().
+        self.delay = 0
+
+    @staticmethod
+    def get_view_scope(view):
+        if hasattr(view, 'get_throttle_scope'):
+            return view.get_throttle_scope()
+        return getattr(view, 'throttle_scopes', {}).get(
+            getattr(view, 'action', None))
+
+    def get_rate(self):
+        # Читаем настройки при каждом запросе, а не при импорте,
+        # чтобы частоты можно было переопределить в override_settings.
+        try:
+            return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+        except KeyError:
+            raise ImproperlyConfigured(
+                f'Не задана частота для scope {self.scope}.')
+
+    def allow_request(self, request, view):
+        return self.check(self.get_view_scope(view), request, request.user)
+
+    def check(self, scope, request, user):
+        """Забирает токен из ведра scope; scope None — без ограничения."""
+        if scope is None:
+            return True
+        self.scope = scope
+        self.rate = self.get_rate()
+        if self.rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+
+        ident = (f'user-{user.pk}' if user and user.is_authenticated
+                 else f'ip-{self.get_ident(request)}')
+        self.key = self.cache_format % {'scope': scope, 'ident': ident}
+        self.now = self.timer()
+        arrival = max(self.cache.get(self.key, self.now), self.now)
+        arrival += self.duration / self.num_requests
+        self.delay = arrival - self.now - self.duration
+        if self.delay > 0:
+            REJECTED_REQUESTS.labels(
+                getattr(request, 'metrics_view', scope), 'throttled').inc()
+            return False
+        self.cache.set(self.key, arrival, math.ceil(arrival - self.now))
+        return True
+
+    def wait(self):
+        return self.delay
@@ -0,0 +1,47 @@
+import threading
+
+from django.db import transaction
+
+
+class OnCommitBuffer:
+    """Копит записи до фиксации транзакции и передаёт их flush()
+    одним вызовом; вне транзакции flush() вызывается сразу.
+
+    Записи — словарь: повторный ключ в той же транзакции заменяет
+    значение, так что один объект обрабатывается один раз. При откате
+    транзакции Django отбрасывает обработчик on_commit, и следующая
+    запись начинает новый буфер.
+
+    Объявляется в теле класса после метода flush:
+
+        pending = OnCommitBuffer(write)
+
+    и связывает classmethod или staticmethod с классом сам.
+    """
+
+    def __init__(self, flush, using=None):
+        self.flush = flush
+        self.using = using
+        self.local = threading.local()
+
+    def __set_name__(self, owner, name):
+        self.flush = self.flush.__get__(None, owner)
+
+    def add(self, items):
+        connection = transaction.get_connection(self.using)
+        if not connection.in_atomic_block:
+            self.flush(dict(items))
+            return
+        callback = getattr(self.local, 'callback', None)
+        if callback is None or not any(
+                entry[1] is callback for entry in connection.run_on_commit):
+            pending = {}
+
+            def callback():
+                self.local.callback = None
+                self.flush(pending)
+
+            callback.pending = pending
+            self.local.callback = callback
+            transaction.on_commit(callback, using=self.using)
+        callback.pending.update(items)
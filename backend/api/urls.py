@@ -1,7 +1,8 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from . import views
+from . import async_views, views
 from .views import RecipeViewSet, UsersViewSet, TagsViewSet, IngredientsViewSet
 
 router = DefaultRouter()
@@ -23,4 +24,40 @@ urlpatterns = [
     path('recipes/<int:pk>/favorite/',
          views.FavoriteAPIView.as_view(),
          name='add_to_favorite'),
+    path('sync/', views.SyncAPIView.as_view(), name='sync'),
 ]
+
+if settings.ASYNC_API:
+    # Под ASGI запросы к этим адресам, включая запись рецептов,
+    # выполняются параллельно в потоках пула.
+    recipe_detail_actions = {'get': 'retrieve', 'put': 'update',
+                             'patch': 'partial_update', 'delete': 'destroy'}
+    urlpatterns = [
+        path('recipes/',
+             async_views.threaded_view(
+                 RecipeViewSet.as_view({'get': 'list', 'post': 'create'})),
+             name='recipes-list'),
+        path('recipes/<int:pk>/',
+             async_views.threaded_view(
+                 RecipeViewSet.as_view(recipe_detail_actions)),
+             name='recipes-detail'),
+        path('tags/',
+             async_views.threaded_view(TagsViewSet.as_view({'get': 'list'})),
+             name='tags-list'),
+        path('tags/<int:pk>/',
+             async_views.threaded_view(
+                 TagsViewSet.as_view({'get': 'retrieve'})),
+             name='tags-detail'),
+        path('ingredients/',
+             async_views.threaded_view(
+                 IngredientsViewSet.as_view({'get': 'list'})),
+             name='ingredients-list'),
+        path('ingredients/<int:pk>/',
+             async_views.threaded_view(
+                 IngredientsViewSet.as_view({'get': 'retrieve'})),
+             name='ingredients-detail'),
+        path('users/subscriptions/',
+             async_views.threaded_view(
+                 views.SubscriptionsListAPIView.as_view()),
+             name='subscriptions_list'),
+    ] + urlpatterns
@@ -1,10 +1,35 @@
+import datetime
+import hashlib
 import http
+import math
 
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Count, Exists, Max, OuterRef, Subquery
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control, patch_vary_headers)
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date
 from rest_framework import serializers
 from rest_framework.response import Response
 
-from recipes.models import Recipe
+from foodgram.metrics import IMAGE_UPLOAD_BYTES
+from recipes.models import (ChangeLogEntry, Favorite, Recipe, ShoppingCart,
+                            Subscription)
+from .cache import AnonymousResponseCache, RecipeRepresentationCache
+from .paginators import UsersAndRecipeListAPIPagination
+from .transactions import OnCommitBuffer
+
+VIEWER_FLAGS = ('is_favorited', 'is_in_shopping_cart', 'is_subscribed')
+# Значения ?ordering= (с необязательным минусом) и поля сортировки;
+# у каждого есть индекс (поле, id) и (author, поле, id).
+RECIPE_ORDERINGS = {
+    'cooking_time': 'cooking_time',
+    'created': 'created_at',
+    'name': 'name',
+}
 
 
 class RecipeManager:
@@ -14,8 +39,315 @@ class RecipeManager:
         if not value:
             raise serializers.ValidationError(
                 "Поле image не может быть пустым.")
+        IMAGE_UPLOAD_BYTES.inc(value.size)
         return value
 
+    @staticmethod
+    def filter_recipes(queryset, query_params, user):
+        is_favorited = query_params.get('is_favorited')
+        is_in_shopping_cart = query_params.get('is_in_shopping_cart')
+        author_id = query_params.get('author')
+        tags = query_params.getlist('tags')
+
+        if user.is_authenticated:
+            if is_favorited:
+                queryset = queryset.filter(favorite_by__user=user)
+            if is_in_shopping_cart:
+                queryset = queryset.filter(in_shopping_carts__user=user)
+
+        if author_id:
+            if author_id == 'me':
+                queryset = queryset.filter(author=user)
+            else:
+                queryset = queryset.filter(author_id=author_id)
+
+        if tags:
+            queryset = queryset.filter(tags__slug__in=tags).distinct()
+
+        max_calories = RecipeManager.parse_calories(
+            query_params.get('max_calories'))
+        if max_calories is not None:
+            # Рецепты с неизвестной калорийностью (NULL) не подходят.
+            queryset = queryset.filter(calories__lte=max_calories)
+
+        for param, lookup in (('cooking_time_min', 'cooking_time__gte'),
+                              ('cooking_time_max', 'cooking_time__lte')):
+            value = RecipeManager.parse_minutes(param,
+                                                query_params.get(param))
+            if value is not None:
+                queryset = queryset.filter(**{lookup: value})
+
+        created_after = RecipeManager.parse_moment(
+            'created_after', query_params.get('created_after'))
+        if created_after is not None:
+            queryset = queryset.filter(created_at__gt=created_after)
+
+        ordering = query_params.get('ordering', '')
+        field = RECIPE_ORDERINGS.get(ordering.removeprefix('-'))
+        if field:
+            direction = '-' if ordering.startswith('-') else ''
+            queryset = queryset.order_by(direction + field, direction + 'id')
+
+        return queryset
+
+    @staticmethod
+    def parse_minutes(name, value):
+        """Граница ?cooking_time_min= или ?cooking_time_max=:
+        неотрицательное целое число минут."""
+        if value is None or value == '':
+            return None
+        try:
+            minutes = int(value)
+        except ValueError:
+            minutes = -1
+        if minutes < 0:
+            raise serializers.ValidationError(
+                {name: 'Ожидается неотрицательное целое число.'})
+        return minutes
+
+    @staticmethod
+    def parse_moment(name, value):
+        """Дата или дата со временем в ISO 8601; без часового пояса
+        считается в текущем."""
+        if value is None or value == '':
+            return None
+        try:
+            moment = parse_datetime(value)
+            if moment is None:
+                day = parse_date(value)
+                if day is None:
+                    raise ValueError(value)
+                moment = datetime.datetime.combine(day, datetime.time())
+        except ValueError:
+            raise serializers.ValidationError(
+                {name: 'Ожидается дата или дата со временем в ISO 8601.'})
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
+    @staticmethod
+    def parse_calories(value):
+        """Порог ?max_calories=: конечное неотрицательное число."""
+        if value is None or value == '':
+            return None
+        try:
+            calories = float(value)
+        except ValueError:
+            calories = math.nan
+        if not math.isfinite(calories) or calories < 0:
+            raise serializers.ValidationError(
+                {'max_calories': 'Ожидается неотрицательное число.'})
+        return calories
+
+    @staticmethod
+    def parse_ids(value):
+        """Список id из параметра ?ids=1,2,3 без повторов, в исходном
+        порядке и не длиннее BATCH_FETCH_MAX_IDS."""
+        try:
+            ids = list(dict.fromkeys(
+                int(part) for part in value.split(',') if part.strip()))
+        except ValueError:
+            raise serializers.ValidationError(
+                {'ids': 'Ожидается список id через запятую.'})
+        if len(ids) > settings.BATCH_FETCH_MAX_IDS:
+            raise serializers.ValidationError(
+                {'ids': f'Не больше {settings.BATCH_FETCH_MAX_IDS} '
+                        f'рецептов за запрос.'})
+        return ids
+
+    @staticmethod
+    def is_deep_page(query_params):
+        """Страница списка дальше DEEP_PAGE_OFFSET рецептов."""
+        pagination = UsersAndRecipeListAPIPagination
+        try:
+            page = int(query_params.get('page', 1))
+            limit = int(query_params.get(pagination.page_size_query_param,
+                                         pagination.page_size))
+        except ValueError:
+            return False
+        limit = min(max(limit, 1), pagination.max_page_size)
+        return (page - 1) * limit >= settings.DEEP_PAGE_OFFSET
+
+    @staticmethod
+    def subscribed_authors(user, author_ids):
+        """Авторы из author_ids, на которых подписан пользователь."""
+        if not user or user.is_anonymous:
+            return set()
+        subscribed = set(Subscription.subscription.through.objects.filter(
+            subscription__user=user, user_id__in=author_ids
+        ).values_list('user_id', flat=True))
+        subscribed.discard(user.id)
+        return subscribed
+
+    @classmethod
+    def viewer_flags(cls, user, recipe_ids, author_ids, flags=VIEWER_FLAGS):
+        """Возвращает множества избранных рецептов, рецептов в корзине
+        и авторов, на которых подписан пользователь, за три запроса.
+        Флаги не из flags не запрашиваются и остаются пустыми."""
+        favorited, in_cart, subscribed = set(), set(), set()
+        if not user or user.is_anonymous:
+            return favorited, in_cart, subscribed
+        if 'is_favorited' in flags:
+            favorited = set(Favorite.recipes.through.objects.filter(
+                favorite__user=user, recipe_id__in=recipe_ids
+            ).values_list('recipe_id', flat=True))
+        if 'is_in_shopping_cart' in flags:
+            in_cart = set(ShoppingCart.recipes.through.objects.filter(
+                shoppingcart__user=user, recipe_id__in=recipe_ids
+            ).values_list('recipe_id', flat=True))
+        if 'is_subscribed' in flags:
+            subscribed = cls.subscribed_authors(user, author_ids)
+        return favorited, in_cart, subscribed
+
+    @staticmethod
+    def touch(recipe_ids):
+        """Обновляет дату изменения рецептов и сбрасывает их кэш там,
+        где изменение не проходит через Recipe.save().
+
+        В транзакции рецепты копятся и обновляются один раз после
+        фиксации, сколько бы строк рецепта ни изменилось."""
+        RecipeManager.touched.add(dict.fromkeys(recipe_ids))
+
+    @staticmethod
+    def flush_touched(recipe_ids):
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+        Recipe.objects.filter(id__in=recipe_ids).update(
+            updated_at=timezone.now())
+        RecipeRepresentationCache.invalidate(recipe_ids)
+        AnonymousResponseCache.invalidate_all()
+
+    touched = OnCommitBuffer(flush_touched)
+
+    @staticmethod
+    def viewer_version(user):
+        """Версия избранного, корзины и подписок пользователя одним
+        запросом: от них зависят флаги в представлении рецептов."""
+        if not user or user.is_anonymous:
+            return 'anonymous'
+        annotations = {}
+        for name, queryset, lookup in (
+            ('favorites', Favorite.recipes.through.objects,
+             'favorite__user'),
+            ('cart', ShoppingCart.recipes.through.objects,
+             'shoppingcart__user'),
+            ('subscriptions', Subscription.subscription.through.objects,
+             'subscription__user'),
+        ):
+            grouped = queryset.filter(**{lookup: OuterRef('pk')}).values(
+                lookup).annotate(total=Count('id'), last=Max('id'))
+            annotations[f'{name}_total'] = Subquery(grouped.values('total'))
+            annotations[f'{name}_last'] = Subquery(grouped.values('last'))
+        state = User.objects.filter(pk=user.pk).annotate(
+            **annotations).values_list(*annotations).first()
+        return f'{user.id}:' + ':'.join(map(str, state))
+
+    @staticmethod
+    def make_etag(*parts):
+        digest = hashlib.md5(':'.join(map(str, parts)).encode(),
+                             usedforsecurity=False).hexdigest()
+        return f'W/"{digest}"'
+
+    @staticmethod
+    def catalog_change():
+        """Последняя запись журнала об изменении тега или ингредиента:
+        от справочников зависят представления всех рецептов. Таких
+        записей мало, индекс по kind находит их без обхода журнала."""
+        return ChangeLogEntry.objects.filter(kind__in=(
+            ChangeLogEntry.TAG, ChangeLogEntry.INGREDIENT)).order_by('-id')[:1]
+
+    @classmethod
+    def list_validators(cls, queryset, user):
+        """ETag и Last-Modified страницы списка по числу рецептов
+        и последнему изменению среди отфильтрованных.
+
+        Удаление не меняет max(updated_at), поэтому учитывается
+        последняя запись об удалении рецепта в журнале изменений;
+        изменения справочников — по последней их записи."""
+        deletion = ChangeLogEntry.objects.filter(
+            kind=ChangeLogEntry.RECIPE, deleted=True).order_by('-id')[:1]
+        catalog = cls.catalog_change()
+        state = queryset.order_by().aggregate(
+            total=Count('id'), last_modified=Max('updated_at'),
+            deleted_id=Max(Subquery(deletion.values('id'))),
+            deleted_at=Max(Subquery(deletion.values('created_at'))),
+            catalog_id=Max(Subquery(catalog.values('id'))),
+            catalog_at=Max(Subquery(catalog.values('created_at'))))
+        last_modified = max(filter(None, (state['last_modified'],
+                                          state['deleted_at'],
+                                          state['catalog_at'])),
+                            default=None)
+        etag = cls.make_etag(state['total'], last_modified,
+                             state['deleted_id'], state['catalog_id'],
+                             cls.viewer_version(user))
+        return etag, last_modified
+
+    @classmethod
+    def detail_validators(cls, recipe_id, user):
+        catalog = cls.catalog_change()
+        try:
+            updated_at, catalog_id, catalog_at = Recipe.objects.annotate(
+                catalog_id=Subquery(catalog.values('id')),
+                catalog_at=Subquery(catalog.values('created_at')),
+            ).values_list('updated_at', 'catalog_id', 'catalog_at').get(
+                pk=recipe_id)
+        except (Recipe.DoesNotExist, ValueError):
+            return None
+        last_modified = max(filter(None, (updated_at, catalog_at)))
+        return (cls.make_etag(recipe_id, updated_at, catalog_id,
+                              cls.viewer_version(user)),
+                last_modified)
+
+    @staticmethod
+    def not_modified(request, user, validators):
+        """Возвращает 304 (или 412), если клиент прислал актуальные
+        If-None-Match или If-Modified-Since."""
+        if validators is None:
+            return None
+        etag, last_modified = validators
+        if user.is_authenticated:
+            # Флаги пользователя не влияют на дату изменения рецептов.
+            last_modified = None
+        response = get_conditional_response(
+            request, etag=etag,
+            last_modified=last_modified and int(last_modified.timestamp()))
+        if response is not None:
+            RecipeManager.add_validators(response, user, validators)
+        return response
+
+    @staticmethod
+    def add_validators(response, user, validators):
+        if validators is None or not 200 <= response.status_code < 400:
+            return response
+        etag, last_modified = validators
+        response['ETag'] = etag
+        if last_modified and not user.is_authenticated:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    @classmethod
+    def conditional_response(cls, request, validators, respond):
+        """Вызывает respond() только если у клиента нет актуальной
+        версии ответа."""
+        response = cls.not_modified(request, request.user, validators)
+        if response is None:
+            response = cls.add_validators(respond(), request.user,
+                                          validators)
+        return response
+
+    @staticmethod
+    def with_collected(collection_model, user):
+        """Рецепты с флагом collected — есть ли рецепт в избранном или
+        корзине пользователя, — чтобы не проверять это отдельным
+        запросом."""
+        return Recipe.objects.annotate(collected=Exists(
+            collection_model.recipes.through.objects.filter(
+                **{f'{collection_model._meta.model_name}__user': user},
+                recipe_id=OuterRef('pk'))))
+
     @staticmethod
     def add_recipe_to_collection(user,
                                  recipe_id,
@@ -23,13 +355,15 @@ class RecipeManager:
                                  serializer_class,
                                  request):
         try:
-            recipe = Recipe.objects.get(pk=recipe_id)
+            recipe = RecipeManager.with_collected(
+                collection_model, user).get(pk=recipe_id)
         except Recipe.DoesNotExist:
             return Response({'error': 'Рецепт не найден.'},
                             status=http.HTTPStatus.BAD_REQUEST)
-        collection, created = collection_model.objects.get_or_create(user=user)
 
-        if not collection.recipes.filter(pk=recipe_id).exists():
+        if not recipe.collected:
+            collection, created = collection_model.objects.get_or_create(
+                user=user)
             collection.recipes.add(recipe)
             serializer = serializer_class(recipe, context={'request': request})
             return Response(serializer.data, status=http.HTTPStatus.CREATED)
@@ -41,10 +375,12 @@ class RecipeManager:
     @staticmethod
     def remove_recipe_from_collection(user, recipe_id, collection_model):
 
-        recipe = get_object_or_404(Recipe, pk=recipe_id)
+        recipe = get_object_or_404(
+            RecipeManager.with_collected(collection_model, user),
+            pk=recipe_id)
         collection = get_object_or_404(collection_model, user=user)
 
-        if collection.recipes.filter(pk=recipe_id).exists():
+        if recipe.collected:
             collection.recipes.remove(recipe)
             return Response(
                 {'success': 'Рецепт удалён из избранного/корзины.'},
@@ -1,5 +1,6 @@
 import http
 
+from django.conf import settings
 from django.db.models import Sum
 from django.http import HttpResponse
 from djoser.views import UserViewSet
@@ -10,20 +11,71 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from recipes.models import Subscription
+from .cache import AnonymousResponseCache
+from .changelog import ChangeLog, SyncResetRequired
+from .nutrition import NUTRIENTS, NutritionCalculator
 from .paginators import UsersAndRecipeListAPIPagination
 from .permissions import IsAuthorOrReadOnly
+from .read_serializers import (IngredientReadSerializer,
+                               RecipeReadSerializer,
+                               ShortRecipeReadSerializer,
+                               SubscriptionReadSerializer, TagReadSerializer,
+                               UserReadSerializer)
 from .serializers import (User, Tag,
                           TagSerializer, Ingredient, IngredientSerializer,
                           Recipe, ShoppingCart,
                           ShoppingCartAndFavoritesSerializer,
                           RecipeIngredient, Favorite, SubscriptionSerializer,
                           RecipeSerializer, CreateRecipeSerializer)
+from .similarity import MinHashIndex
 from .utils import RecipeManager
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class ReadSerializerMixin:
+    """На GET-запросах list и retrieve отдаёт строки .values()
+    сериализатору read_serializer_class вместо ModelSerializer."""
+
+    read_serializer_class = None
+
+    def uses_read_serializer(self):
+        return (self.request.method in ('GET', 'HEAD')
+                and getattr(self, 'action', 'list') in ('list', 'retrieve'))
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.uses_read_serializer():
+            return self.read_serializer_class.values(queryset,
+                                                     self.request)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.uses_read_serializer():
+            return self.read_serializer_class
+        return super().get_serializer_class()
+
+
+class AnonymousResponseCacheMixin:
+    """Отдаёт list и retrieve анонимам из AnonymousResponseCache."""
+
+    @AnonymousResponseCache.cached
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @AnonymousResponseCache.cached
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+class RecipeViewSet(ReadSerializerMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all().order_by('-id')
     pagination_class = UsersAndRecipeListAPIPagination
+    read_serializer_class = RecipeReadSerializer
+    throttle_scopes = {
+        'download_shopping_cart': 'shopping_list',
+        'create': 'recipe_write',
+        'update': 'recipe_write',
+        'partial_update': 'recipe_write',
+    }
 
     def get_permissions(self):
         if self.action in ['update', 'partial_update', 'destroy']:
@@ -34,7 +86,15 @@ class RecipeViewSet(viewsets.ModelViewSet):
             permission_classes = [AllowAny]
         return [permission() for permission in permission_classes]
 
+    def get_throttle_scope(self):
+        if (self.action == 'list'
+                and RecipeManager.is_deep_page(self.request.query_params)):
+            return 'deep_pages'
+        return self.throttle_scopes.get(self.action)
+
     def get_serializer_class(self):
+        if self.uses_read_serializer():
+            return self.read_serializer_class
         if self.action in ['create', 'update', 'partial_update']:
             return CreateRecipeSerializer
         elif self.action == 'download_shopping_cart':
@@ -45,30 +105,76 @@ class RecipeViewSet(viewsets.ModelViewSet):
         queryset = super().get_queryset()
         if self.action != 'list':
             return queryset
+        return RecipeManager.filter_recipes(queryset,
+                                            self.request.query_params,
+                                            self.request.user)
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        self.duplicate_of = serializer.duplicate_of
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        if self.duplicate_of is not None:
+            # Похожий рецепт уже есть, но DUPLICATE_RECIPE_ACTION
+            # разрешает сохранить новый: сообщаем клиенту заголовком.
+            response['X-Duplicate-Of'] = str(self.duplicate_of)
+        return response
 
-        is_favorited = self.request.query_params.get('is_favorited')
-        is_in_shopping_cart = self.request.query_params.get(
-            'is_in_shopping_cart')
-        author_id = self.request.query_params.get('author')
-        tags = self.request.query_params.getlist('tags')
-
-        if self.request.user.is_authenticated:
-            if is_favorited:
-                queryset = queryset.filter(favorite_by__user=self.request.user)
-            if is_in_shopping_cart:
-                queryset = queryset.filter(
-                    in_shopping_carts__user=self.request.user)
-
-        if author_id:
-            if author_id == 'me':
-                queryset = queryset.filter(author=self.request.user)
-            else:
-                queryset = queryset.filter(author_id=author_id)
-
-        if tags:
-            queryset = queryset.filter(tags__slug__in=tags).distinct()
-
-        return queryset
+    @AnonymousResponseCache.cached
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        ids = request.query_params.get('ids')
+        if ids is None:
+            return RecipeManager.conditional_response(
+                request, RecipeManager.list_validators(queryset, request.user),
+                lambda: super(RecipeViewSet, self).list(
+                    request, *args, **kwargs))
+
+        # ?ids=1,2,3: рецепты одним ответом без пагинации, в порядке
+        # запроса; отсутствующие id пропускаются.
+        ids = RecipeManager.parse_ids(ids)
+        queryset = queryset.filter(id__in=ids)
+        return RecipeManager.conditional_response(
+            request, RecipeManager.list_validators(queryset, request.user),
+            lambda: Response(self.get_serializer(
+                self.ordered_by_ids(queryset, ids), many=True).data))
+
+    @staticmethod
+    def ordered_by_ids(queryset, ids):
+        rows = {row['id']: row for row in queryset}
+        return [rows[recipe_id] for recipe_id in ids if recipe_id in rows]
+
+    @AnonymousResponseCache.cached
+    def retrieve(self, request, *args, **kwargs):
+        validators = RecipeManager.detail_validators(kwargs['pk'],
+                                                     request.user)
+        return RecipeManager.conditional_response(
+            request, validators,
+            lambda: super(RecipeViewSet, self).retrieve(
+                request, *args, **kwargs))
+
+    @action(methods=['get'], detail=True)
+    def similar(self, request, pk=None):
+        recipe = self.get_object()
+        try:
+            limit = int(request.query_params.get(
+                'limit', self.pagination_class.page_size))
+        except ValueError:
+            return Response({'error': 'limit должен быть числом.'},
+                            status=http.HTTPStatus.BAD_REQUEST)
+        limit = min(max(limit, 1), settings.SIMILAR_RECIPES_MAX_LIMIT)
+
+        scores = dict(MinHashIndex.similar(recipe.id, limit))
+        rows = {row['id']: row for row in ShortRecipeReadSerializer.values(
+            Recipe.objects.filter(id__in=scores), request)}
+        found = [recipe_id for recipe_id in scores if recipe_id in rows]
+        recipes = ShortRecipeReadSerializer(
+            [rows[recipe_id] for recipe_id in found],
+            many=True, context={'request': request}).data
+        for recipe_id, data in zip(found, recipes):
+            data['similarity'] = round(scores[recipe_id], 3)
+        return Response(recipes)
 
     @action(methods=['get'], detail=False)
     def download_shopping_cart(self, request, pk=None, *args, **kwargs):
@@ -86,7 +192,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         ingredients = RecipeIngredient.objects.filter(
             recipe__in=recipes).values(
-            'ingredient__name', 'ingredient__measurement_unit').annotate(
+            'ingredient__name', 'ingredient__measurement_unit',
+            *(f'ingredient__{name}' for name in NUTRIENTS)).annotate(
             total_amount=Sum('amount')).order_by('ingredient__name')
 
         shopping_list = "\r\n".join([
@@ -94,7 +201,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
              f"({item['ingredient__measurement_unit']}) — "
              f"{item['total_amount']}")
             for item in ingredients
-        ])
+        ] + NutritionCalculator.shopping_list_section(ingredients))
 
         response = HttpResponse(shopping_list,
                                 content_type='text/plain; charset=utf-8')
@@ -103,8 +210,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return response
 
 
-class UsersViewSet(UserViewSet):
+class UsersViewSet(ReadSerializerMixin, UserViewSet):
     pagination_class = UsersAndRecipeListAPIPagination
+    read_serializer_class = UserReadSerializer
 
     def get_permissions(self):
         if self.action == 'me':
@@ -114,15 +222,19 @@ class UsersViewSet(UserViewSet):
         return super().get_permissions()
 
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+class TagsViewSet(AnonymousResponseCacheMixin, ReadSerializerMixin,
+                  viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    read_serializer_class = TagReadSerializer
     pagination_class = None
 
 
-class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientsViewSet(AnonymousResponseCacheMixin, ReadSerializerMixin,
+                         viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
+    read_serializer_class = IngredientReadSerializer
     pagination_class = None
 
     def get_queryset(self):
@@ -177,17 +289,44 @@ class FavoriteAPIView(APIView):
         )
 
 
-class SubscriptionsListAPIView(generics.ListAPIView):
+class SyncAPIView(APIView):
+    """Изменения после курсора since для офлайн-клиентов.
+
+    Без since возвращает только текущий курсор: клиент загружает данные
+    обычными запросами и дальше забирает изменения. Пока has_more
+    истинно, запрос повторяется с новым курсором.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        since = request.query_params.get('since')
+        if since is None:
+            return Response({'cursor': ChangeLog.latest_cursor(),
+                             'has_more': False})
+        try:
+            since = int(since)
+        except ValueError:
+            return Response({'error': 'since должен быть числом.'},
+                            status=http.HTTPStatus.BAD_REQUEST)
+        try:
+            return Response(ChangeLog.changes(since, request.user, request))
+        except SyncResetRequired:
+            return Response(
+                {'error': 'Журнал изменений сжат, загрузите данные '
+                          'заново.',
+                 'cursor': ChangeLog.latest_cursor()},
+                status=http.HTTPStatus.GONE)
+
+
+class SubscriptionsListAPIView(ReadSerializerMixin, generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = SubscriptionSerializer
+    read_serializer_class = SubscriptionReadSerializer
     pagination_class = UsersAndRecipeListAPIPagination
 
     def get_queryset(self):
-        try:
-            return Subscription.objects.get(
-                user=self.request.user).subscription.all()
-        except Subscription.DoesNotExist:
-            return []
+        return User.objects.filter(
+            following__user=self.request.user).order_by('id')
 
 
 class SubscriptionsAPIView(APIView):
@@ -1,7 +1,11 @@
 #!/bin/sh
-python manage.py makemigrations
-python manage.py migrate
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
 
-python manage.py collectstatic --no-input
-python manage.py fill_db
-gunicorn foodgram.wsgi:application --bind 0.0.0.0:8000
\ No newline at end of file
+# Статика собрана при сборке образа, здесь её нужно только скопировать в том.
+cp -r /app/collected_static/. /static/
+
+python manage.py migrate_locked
+python manage.py fill_db --skip-if-loaded
+gunicorn "foodgram.${SERVER_MODE:-wsgi}:application" --config gunicorn.conf.py
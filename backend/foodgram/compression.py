@@ -0,0 +1,52 @@
+import gzip
+import re
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+COMPRESSIBLE_TYPES = re.compile(
+    r'^(text/|application/(json|javascript|xml|yaml|x-yaml)|image/svg\+xml)')
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.map', '.json', '.svg', '.html',
+                           '.txt', '.xml', '.yml', '.yaml', '.ico', '.ttf',
+                           '.eot')
+QUALITY = re.compile(r'q=([0-9.]+)')
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def available_encodings():
+    """Кодировки в порядке предпочтения."""
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+
+def negotiate(accept_encoding):
+    """Выбирает кодировку по заголовку Accept-Encoding с учётом q."""
+    accepted = {}
+    for part in accept_encoding.lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        match = QUALITY.search(params)
+        try:
+            accepted[coding.strip()] = float(match[1]) if match else 1.0
+        except ValueError:
+            continue
+    best, best_quality = None, 0
+    for coding in available_encodings():
+        quality = accepted.get(coding, accepted.get('*', 0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(content, encoding, static=False):
+    """Сжимает ответ с настройками из settings; статика собирается
+    один раз, поэтому для неё берётся максимальная степень сжатия."""
+    if encoding == 'br':
+        return brotli.compress(
+            content,
+            quality=11 if static else settings.COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(
+        content, mtime=0,
+        compresslevel=9 if static else settings.COMPRESSION_GZIP_LEVEL)
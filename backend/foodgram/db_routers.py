@@ -0,0 +1,27 @@
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Реплика, выбранная для текущего запроса, или None.
+replica = ContextVar('replica', default=None)
+
+
+class ReadReplicaRouter:
+    """Направляет чтение на реплики, если это разрешено для запроса.
+
+    Реплику выбирает ReplicaRoutingMiddleware один раз на безопасный
+    запрос к тяжёлому представлению, и все его запросы читают с неё
+    один снимок; запись всегда идёт в default.
+    """
+
+    def db_for_read(self, model, **hints):
+        return replica.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.REPLICA_DATABASES
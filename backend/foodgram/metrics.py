@@ -0,0 +1,53 @@
+import os
+
+from django.http import HttpResponse
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+REQUEST_LATENCY = Histogram(
+    'foodgram_request_duration_seconds',
+    'Время обработки запроса по представлению и действию DRF.',
+    ['view', 'method', 'status'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10),
+)
+DB_QUERIES = Counter(
+    'foodgram_db_queries_total',
+    'Число SQL-запросов по представлению.',
+    ['view'],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'foodgram_requests_in_progress',
+    'Число запросов, обрабатываемых в данный момент.',
+    multiprocess_mode='livesum',
+)
+CACHE_REQUESTS = Counter(
+    'foodgram_cache_requests_total',
+    'Обращения к кэшам приложения с результатом hit или miss.',
+    ['cache', 'result'],
+)
+REJECTED_REQUESTS = Counter(
+    'foodgram_rejected_requests_total',
+    'Запросы, отклонённые с 429: throttled — по частоте, '
+    'overloaded — по числу одновременных запросов.',
+    ['view', 'reason'],
+)
+IMAGE_UPLOAD_BYTES = Counter(
+    'foodgram_image_upload_bytes_total',
+    'Объём загруженных изображений рецептов в байтах.',
+)
+
+
+def registry():
+    """Реестр метрик; при работе под gunicorn собирает данные всех
+    процессов из каталога PROMETHEUS_MULTIPROC_DIR."""
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    collector_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collector_registry)
+    return collector_registry
+
+
+def metrics_view(request):
+    return HttpResponse(generate_latest(registry()),
+                        content_type=CONTENT_TYPE_LATEST)
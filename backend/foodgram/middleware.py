@@ -0,0 +1,330 @@
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.http import JsonResponse
+from django.utils.cache import has_vary_header, patch_vary_headers
+from rest_framework.throttling import BaseThrottle
+
+from foodgram import metrics, profiling
+from foodgram.compression import COMPRESSIBLE_TYPES, compress, negotiate
+from foodgram.db_routers import replica
+
+logger = logging.getLogger('foodgram.requests')
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PLACEHOLDERS = re.compile(r'(%s|\?)(\s*,\s*(%s|\?))+')
+
+
+def view_name(request, view_func):
+    """Имя представления вида RecipeViewSet.list для метрик и роутинга."""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return view_func.__name__
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{view_class.__name__}.{action}'
+
+
+def fingerprint(sql):
+    """Приводит запрос к виду без переменного числа параметров в IN."""
+    return PLACEHOLDERS.sub('%s', sql)
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.items()
+                if count > 1}
+
+
+class HybridMiddleware:
+    """Middleware, работающий без переходников и под WSGI, и под ASGI.
+
+    Наследники описывают замер в контекстном менеджере measure()
+    и обработку ответа в finish().
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with self.measure(request) as state:
+            response = self.get_response(request)
+        return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        with self.measure(request) as state:
+            response = await self.get_response(request)
+        return self.finish(request, response, state)
+
+    def measure(self, request):
+        raise NotImplementedError
+
+    def finish(self, request, response, state):
+        return response
+
+
+class RequestProfilingMiddleware(HybridMiddleware):
+    """Замеряет SQL-запросы ко всем базам, время сериализации и время
+    обработки для доли запросов.
+
+    Отрезок serializer включает запросы, выполненные сериализатором.
+    Включается переменной окружения REQUEST_PROFILING, доля
+    замеряемых запросов задаётся REQUEST_PROFILING_SAMPLE_RATE.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.sample_rate = settings.REQUEST_PROFILING_SAMPLE_RATE
+
+    @contextmanager
+    def measure(self, request):
+        if random.random() >= self.sample_rate:
+            yield None
+            return
+        recorder = QueryRecorder()
+        recorder.started = time.perf_counter()
+        with profiling.observe_queries(recorder), \
+                profiling.record_segments() as recorder.segments:
+            yield recorder
+
+    def finish(self, request, response, recorder):
+        if recorder is None:
+            return response
+        total = time.perf_counter() - recorder.started
+        serializer = recorder.segments['serializer']
+
+        duplicates = recorder.duplicates()
+        size = (None if response.streaming
+                else len(response.content))
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={recorder.duration * 1000:.2f};'
+            f'desc="{recorder.count} queries"',
+            f'serializer;dur={serializer * 1000:.2f}',
+            f'app;dur={(total - recorder.duration) * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ))
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(recorder.duration * 1000, 2),
+            'serializer_ms': round(serializer * 1000, 2),
+            'app_ms': round((total - recorder.duration) * 1000, 2),
+            'queries': recorder.count,
+            'duplicate_queries': sum(duplicates.values()),
+            'duplicates': sorted(duplicates.items(),
+                                 key=lambda item: -item[1])[:5],
+            'response_bytes': size,
+        }, ensure_ascii=False))
+        return response
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """Собирает метрики Prometheus по представлениям и действиям DRF."""
+
+    @contextmanager
+    def measure(self, request):
+        request.metrics_view = 'unresolved'
+        counter = QueryCounter()
+        counter.started = time.perf_counter()
+        metrics.REQUESTS_IN_PROGRESS.inc()
+        try:
+            with profiling.observe_queries(counter):
+                yield counter
+        finally:
+            metrics.REQUESTS_IN_PROGRESS.dec()
+
+    def finish(self, request, response, counter):
+        metrics.REQUEST_LATENCY.labels(
+            request.metrics_view, request.method, response.status_code
+        ).observe(time.perf_counter() - counter.started)
+        if counter.count:
+            metrics.DB_QUERIES.labels(request.metrics_view).inc(counter.count)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = view_name(request, view_func)
+
+
+class ReplicaRoutingMiddleware(HybridMiddleware):
+    """Разрешает чтение с реплик для безопасных запросов к представлениям
+    из REPLICA_READ_VIEWS.
+
+    После успешного изменяющего запроса клиент на REPLICA_STICKY_SECONDS
+    закрепляется за основной базой, чтобы видеть свои изменения.
+    Отметка хранится в общем кэше: следующий запрос клиента может
+    попасть в другой воркер или на другой сервер.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REPLICA_DATABASES:
+            raise MiddlewareNotUsed
+        if isinstance(caches['default'], LocMemCache):
+            raise ImproperlyConfigured(
+                'Для чтения с реплик нужен общий кэш (CACHE_BACKEND): '
+                'в LocMemCache другие воркеры не увидят, что клиент '
+                'закреплён за основной базой.')
+        super().__init__(get_response)
+
+    @staticmethod
+    def sticky_key(request):
+        client = (request.headers.get('Authorization')
+                  or BaseThrottle().get_ident(request))
+        return 'replica-sticky:' + hashlib.sha1(client.encode()).hexdigest()
+
+    @contextmanager
+    def measure(self, request):
+        token = replica.set(None)
+        try:
+            yield None
+        finally:
+            replica.reset(token)
+
+    def finish(self, request, response, state):
+        if (request.method not in SAFE_METHODS
+                and response.status_code < 400):
+            cache.set(self.sticky_key(request), True,
+                      settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (request.method in SAFE_METHODS
+                and view_name(request, view_func)
+                in settings.REPLICA_READ_VIEWS
+                and not cache.get(self.sticky_key(request))):
+            replica.set(random.choice(settings.REPLICA_DATABASES))
+
+
+class CompressionMiddleware(HybridMiddleware):
+    """Сжимает ответы brotli или gzip по заголовку Accept-Encoding.
+
+    Потоковые ответы, ответы меньше COMPRESSION_MIN_SIZE, нетекстовые
+    типы и ответы, уязвимые к BREACH, не сжимаются: пути из
+    COMPRESSION_EXCLUDE_PATHS (токены, админка) и ответы, зависящие
+    от cookie сессии или выставляющие cookie CSRF (страницы с формами).
+    """
+
+    def measure(self, request):
+        return nullcontext()
+
+    def finish(self, request, response, state):
+        if (response.streaming
+                or response.has_header('Content-Encoding')
+                or response.status_code == 206
+                or len(response.content) < settings.COMPRESSION_MIN_SIZE
+                or not COMPRESSIBLE_TYPES.match(
+                    response.get('Content-Type', ''))
+                or request.path.startswith(
+                    settings.COMPRESSION_EXCLUDE_PATHS)
+                or has_vary_header(response, 'Cookie')
+                or settings.CSRF_COOKIE_NAME in response.cookies):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
+
+
+class AdmissionControlMiddleware(HybridMiddleware):
+    """Ограничивает число запросов, одновременно обрабатываемых процессом.
+
+    Запрос сверх ADMISSION_MAX_REQUESTS или запрос к представлению
+    из ADMISSION_HEAVY_VIEWS сверх ADMISSION_MAX_HEAVY_REQUESTS сразу
+    получает 429 с Retry-After. Так всплеск тяжёлых запросов не занимает
+    все потоки воркера, и просмотр рецептов продолжает обслуживаться.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.lock = threading.Lock()
+        self.in_flight = Counter()
+        self.limits = {
+            'all': settings.ADMISSION_MAX_REQUESTS,
+            'heavy': settings.ADMISSION_MAX_HEAVY_REQUESTS,
+        }
+
+    @contextmanager
+    def measure(self, request):
+        request.admission_pools = ()
+        try:
+            yield None
+        finally:
+            with self.lock:
+                self.in_flight.subtract(request.admission_pools)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        name = view_name(request, view_func)
+        pools = (('all', 'heavy') if name in settings.ADMISSION_HEAVY_VIEWS
+                 else ('all',))
+        with self.lock:
+            admitted = all(self.in_flight[pool] < self.limits[pool]
+                           for pool in pools)
+            if admitted:
+                self.in_flight.update(pools)
+        if admitted:
+            request.admission_pools = pools
+            return None
+
+        metrics.REJECTED_REQUESTS.labels(name, 'overloaded').inc()
+        return JsonResponse(
+            {'detail': 'Сервер перегружен, повторите запрос позже.'},
+            status=429, json_dumps_params={'ensure_ascii': False},
+            headers={'Retry-After': str(settings.ADMISSION_RETRY_AFTER)})
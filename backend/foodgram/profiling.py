@@ -0,0 +1,72 @@
+import functools
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Обработчики SQL-запросов текущего запроса (execute_wrapper) и время
+# по отрезкам обработки. Контекст копируется в потоки sync_to_async,
+# поэтому запросы асинхронных представлений тоже попадают в замер.
+query_observers = ContextVar('query_observers', default=())
+segment_timings = ContextVar('segment_timings', default=None)
+current_segment = ContextVar('current_segment', default=None)
+
+
+def dispatch(execute, sql, params, many, context):
+    for observer in query_observers.get():
+        execute = functools.partial(observer, execute)
+    return execute(sql, params, many, context)
+
+
+def install(connection):
+    if dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.append(dispatch)
+
+
+def install_on_new_connections(sender, connection, **kwargs):
+    install(connection)
+
+
+connection_created.connect(install_on_new_connections)
+
+
+@contextmanager
+def observe_queries(observer):
+    """Передаёт observer все запросы ко всем базам, выполненные в этом
+    контексте, в том числе в потоках пула asgiref."""
+    for connection in connections.all():
+        install(connection)
+    token = query_observers.set((*query_observers.get(), observer))
+    try:
+        yield observer
+    finally:
+        query_observers.reset(token)
+
+
+@contextmanager
+def record_segments():
+    token = segment_timings.set(Counter())
+    try:
+        yield segment_timings.get()
+    finally:
+        segment_timings.reset(token)
+
+
+@contextmanager
+def segment(name):
+    """Добавляет время блока к отрезку name замера текущего запроса.
+    Вложенные отрезки не считаются повторно."""
+    timings = segment_timings.get()
+    if timings is None or current_segment.get() is not None:
+        yield
+        return
+    token = current_segment.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] += time.perf_counter() - started
+        current_segment.reset(token)
@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -32,6 +33,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.middleware.MetricsMiddleware',
+    'foodgram.middleware.RequestProfilingMiddleware',
+    'foodgram.middleware.CompressionMiddleware',
+    'foodgram.middleware.AdmissionControlMiddleware',
+    'foodgram.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,10 +76,78 @@ DATABASES = {
         'USER': os.environ.get('POSTGRES_USER'),
         'PASSWORD': os.environ.get('POSTGRES_PASSWORD'),
         'HOST': os.environ.get('POSTGRES_HOST'),
-        'PORT': os.environ.get('POSTGRES_PORT')
+        'PORT': os.environ.get('POSTGRES_PORT'),
+        'CONN_MAX_AGE': int(os.getenv('POSTGRES_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+if os.getenv('POSTGRES_POOL', False) == 'True':
+    # Пул psycopg несовместим с постоянными соединениями Django.
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('POSTGRES_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('POSTGRES_POOL_MAX_SIZE', 10)),
+            'timeout': int(os.getenv('POSTGRES_POOL_TIMEOUT', 10)),
+        },
+    }
+
+# Реплики для чтения; вместе с ними нужен общий кэш (CACHE_BACKEND),
+# иначе ReplicaRoutingMiddleware не запустится.
+REPLICA_DATABASES = []
+for index, replica in enumerate(
+        filter(None, os.getenv('POSTGRES_REPLICA_HOSTS', '').split(','))):
+    host, _, port = replica.partition(':')
+    alias = f'replica_{index}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['foodgram.db_routers.ReadReplicaRouter']
+
+REPLICA_READ_VIEWS = {
+    'RecipeViewSet.list',
+    'RecipeViewSet.retrieve',
+    'RecipeViewSet.download_shopping_cart',
+    'IngredientsViewSet.list',
+    'IngredientsViewSet.retrieve',
+    'TagsViewSet.list',
+    'TagsViewSet.retrieve',
+    'SubscriptionsListAPIView.get',
+}
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND',
+                             'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', 60 * 60))
+
+# Кэш готовых ответов на GET анонимов: срок хранения (0 отключает кэш),
+# сколько ждать ответа, который уже строит другой запрос (только
+# с общим кэшем), и срок микрокэширования в nginx (заголовок
+# X-Accel-Expires, 0 отключает).
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 10 * 60))
+RESPONSE_CACHE_WAIT = float(os.getenv('RESPONSE_CACHE_WAIT', 0.25))
+RESPONSE_MICROCACHE_SECONDS = int(
+    os.getenv('RESPONSE_MICROCACHE_SECONDS', 1))
+
+# Сброс кэшей в памяти процессов на всех воркерах через PostgreSQL
+# LISTEN/NOTIFY (api.invalidation) и размер каждого такого кэша.
+INVALIDATION_BUS = os.getenv('INVALIDATION_BUS', 'True') == 'True'
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv('LOCAL_CACHE_MAX_ENTRIES', 10000))
+# Сколько секунд процесс доверяет проверенному токену без базы.
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 5))
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -95,10 +169,30 @@ REST_FRAMEWORK = {
         "rest_framework.permissions.AllowAny",
     ],
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "api.authentication.CachedTokenAuthentication",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.renderers.OrjsonRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "api.parsers.OrjsonParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
+    "DEFAULT_THROTTLE_CLASSES": [
+        "api.throttling.ActionTokenBucketThrottle",
+    ],
+    "DEFAULT_THROTTLE_RATES": {
+        "shopping_list": os.getenv('THROTTLE_SHOPPING_LIST', '10/min'),
+        "recipe_write": os.getenv('THROTTLE_RECIPE_WRITE', '60/hour'),
+        "deep_pages": os.getenv('THROTTLE_DEEP_PAGES', '60/min'),
+    },
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 6,
+    # Перед приложением стоит nginx: адрес клиента для троттлинга
+    # берётся из X-Forwarded-For, а не из адреса прокси.
+    "NUM_PROXIES": int(os.getenv('NUM_PROXIES', 1)),
     "PAGINATE_BY_PARAM": "limit",
 }
 
@@ -130,11 +224,102 @@ USE_TZ = True
 
 
 STATIC_URL = '/static/'
-STATIC_ROOT = '/static/'
+STATIC_ROOT = os.getenv('STATIC_ROOT', '/static/')
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'foodgram.storage.PrecompressedStaticFilesStorage',
+    },
+}
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = '/media/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+ASYNC_API = os.getenv('ASYNC_API', False) == 'True'
+if ASYNC_API and 'pool' not in DATABASES['default'].get('OPTIONS', {}):
+    # Под ASGI представления выполняются в потоках пула asgiref и
+    # закрывают соединение в конце запроса; без пула psycopg каждый
+    # запрос открывал бы новое соединение с PostgreSQL.
+    raise ImproperlyConfigured(
+        'ASYNC_API (SERVER_MODE=asgi) требует POSTGRES_POOL=True.')
+
+ADMISSION_MAX_REQUESTS = int(os.getenv('ADMISSION_MAX_REQUESTS', 64))
+ADMISSION_MAX_HEAVY_REQUESTS = int(
+    os.getenv('ADMISSION_MAX_HEAVY_REQUESTS', 2))
+ADMISSION_HEAVY_VIEWS = {
+    'RecipeViewSet.download_shopping_cart',
+    'RecipeViewSet.create',
+    'RecipeViewSet.update',
+    'RecipeViewSet.partial_update',
+}
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 1))
+# Страницы списка рецептов дальше этого смещения ограничиваются
+# по частоте как тяжёлые.
+DEEP_PAGE_OFFSET = int(os.getenv('DEEP_PAGE_OFFSET', 600))
+
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 5))
+COMPRESSION_EXCLUDE_PATHS = ('/api/auth/', '/admin/')
+
+# Похожие рецепты: MinHash-подпись из BANDS * ROWS значений и LSH по
+# полосам. После изменения параметров нужно перестроить индекс командой
+# build_similarity_index.
+SIMILAR_RECIPES_BANDS = int(os.getenv('SIMILAR_RECIPES_BANDS', 32))
+SIMILAR_RECIPES_ROWS = int(os.getenv('SIMILAR_RECIPES_ROWS', 3))
+SIMILAR_RECIPES_SEED = int(os.getenv('SIMILAR_RECIPES_SEED', 1983))
+SIMILAR_RECIPES_CANDIDATES = int(
+    os.getenv('SIMILAR_RECIPES_CANDIDATES', 200))
+SIMILAR_RECIPES_MAX_LIMIT = 50
+
+# Что делать с новым рецептом, совпавшим по сигнатуре с уже
+# существующим: 'reject' — вернуть 400, 'warn' — сохранить и указать
+# id похожего рецепта в заголовке X-Duplicate-Of, 'ignore' — ничего.
+# Отдельно для своих рецептов автора и для чужих. Сигнатура не учитывает
+# количества, поэтому варианты своего рецепта (двойная порция, меньше
+# сахара) совпадают с ним, и по умолчанию они только помечаются.
+DUPLICATE_OWN_RECIPE_ACTION = os.getenv(
+    'DUPLICATE_OWN_RECIPE_ACTION', 'warn')
+DUPLICATE_RECIPE_ACTION = os.getenv('DUPLICATE_RECIPE_ACTION', 'warn')
+
+# По сколько рецептов пересчитывать пищевую ценность после изменения
+# ингредиента; каждая пачка записывается в своей транзакции.
+NUTRITION_REFRESH_BATCH_SIZE = int(
+    os.getenv('NUTRITION_REFRESH_BATCH_SIZE', 1000))
+
+# Сколько записей журнала изменений разбирает один запрос /api/sync/.
+SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', 500))
+# Сколько секунд записи журнала не отдаются клиентам: за это время
+# фиксируются транзакции, получившие меньшие id.
+SYNC_SAFETY_LAG = int(os.getenv('SYNC_SAFETY_LAG', 5))
+
+# Сколько рецептов можно запросить одним GET /api/recipes/?ids=.
+BATCH_FETCH_MAX_IDS = int(os.getenv('BATCH_FETCH_MAX_IDS', 100))
+
+REQUEST_PROFILING = os.getenv('REQUEST_PROFILING', False) == 'True'
+REQUEST_PROFILING_SAMPLE_RATE = float(
+    os.getenv('REQUEST_PROFILING_SAMPLE_RATE', 0.1))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'foodgram.requests': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 AUTHENTICATION_BACKENDS = ['foodgram.backends.EmailBackend', 'django.contrib.auth.backends.ModelBackend']
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.contrib.staticfiles.storage import StaticFilesStorage
+from django.core.files.base import ContentFile
+
+from foodgram.compression import (COMPRESSIBLE_EXTENSIONS, SUFFIXES,
+                                  available_encodings, compress)
+
+
+class PrecompressedStaticFilesStorage(StaticFilesStorage):
+    """Кладёт рядом с собранной статикой сжатые копии .gz и .br,
+    которые nginx отдаёт через gzip_static и brotli_static."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        for name in paths:
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            with self.open(name) as file:
+                content = file.read()
+            if len(content) < settings.COMPRESSION_MIN_SIZE:
+                continue
+            for encoding in available_encodings():
+                compressed = compress(content, encoding, static=True)
+                if len(compressed) >= len(content):
+                    continue
+                compressed_name = name + SUFFIXES[encoding]
+                if self.exists(compressed_name):
+                    self.delete(compressed_name)
+                self._save(compressed_name, ContentFile(compressed))
+            yield name, name, True
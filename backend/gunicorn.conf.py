@@ -0,0 +1,84 @@
+import math
+import os
+
+from prometheus_client import multiprocess
+
+
+def read_cgroup(*names):
+    values = []
+    for name in names:
+        with open(f'/sys/fs/cgroup/{name}') as cgroup_file:
+            values.extend(cgroup_file.read().split())
+    return values
+
+
+def available_cpus():
+    """Процессоры, доступные контейнеру: cpu_count() видит все ядра
+    хоста, а не affinity и квоту cgroup (v2 или v1)."""
+    cpus = len(os.sched_getaffinity(0))
+    try:
+        quota, period = read_cgroup('cpu.max')
+    except OSError:
+        try:
+            quota, period = read_cgroup('cpu/cpu.cfs_quota_us',
+                                        'cpu/cpu.cfs_period_us')
+        except OSError:
+            return cpus
+    if quota in ('max', '-1'):
+        return cpus
+    return max(1, min(cpus, math.ceil(int(quota) / int(period))))
+
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+if os.getenv('SERVER_MODE') == 'asgi':
+    # Представления закрывают соединение с базой в конце каждого запроса,
+    # поэтому под ASGI нужен пул psycopg: без POSTGRES_POOL=True
+    # настройки Django не загрузятся (ASYNC_API).
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    # Потоки пула asgiref, в которых выполняются представления.
+    threads = min(32, available_cpus() + 4)
+else:
+    worker_class = 'gthread'
+    threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Каждый воркер держит не больше соединений, чем потоков (или размер пула
+# psycopg), и ещё одно у слушателя InvalidationBus. Вместе они должны
+# помещаться в max_connections PostgreSQL (POSTGRES_MAX_CONNECTIONS)
+# с запасом на миграции, команды управления и суперпользователя.
+if os.getenv('POSTGRES_POOL', False) == 'True':
+    connections_per_worker = int(os.getenv('POSTGRES_POOL_MAX_SIZE', 10))
+else:
+    connections_per_worker = threads
+if os.getenv('INVALIDATION_BUS', 'True') == 'True':
+    connections_per_worker += 1
+connection_budget = (int(os.getenv('POSTGRES_MAX_CONNECTIONS', 100))
+                     - int(os.getenv('POSTGRES_RESERVED_CONNECTIONS', 10)))
+
+workers = int(os.getenv('GUNICORN_WORKERS', max(1, min(
+    available_cpus() * 2 + 1, connection_budget // connections_per_worker))))
+if workers * connections_per_worker > connection_budget:
+    raise RuntimeError(
+        f'{workers} воркеров × {connections_per_worker} соединений больше '
+        f'{connection_budget} доступных (POSTGRES_MAX_CONNECTIONS за '
+        f'вычетом POSTGRES_RESERVED_CONNECTIONS): уменьшите '
+        f'GUNICORN_WORKERS, GUNICORN_THREADS или POSTGRES_POOL_MAX_SIZE.')
+
+# Перезапуск воркеров со сдвигом, чтобы они не уходили на рестарт разом.
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+preload_app = True
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+
+def post_fork(server, worker):
+    # Соединения, открытые мастером при preload_app, не переиспользуются.
+    from django.db import connections
+    connections.close_all()
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
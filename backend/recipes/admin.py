@@ -1,33 +1,167 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import (BooleanField, Count, OuterRef, Prefetch,
+                              Subquery)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+
 from .models import (Tag, Ingredient, Recipe, Favorite, ShoppingCart,
                      Subscription, RecipeIngredient)
 
+LIST_RECIPES_LIMIT = 5
+
+
+class EstimatedCountPaginator(Paginator):
+    """Для нефильтрованного списка большой таблицы в PostgreSQL берёт
+    оценку числа строк из статистики вместо COUNT(*)."""
+
+    estimate_threshold = 100_000
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if connection.vendor == 'postgresql' and not query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    [query.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > self.estimate_threshold:
+                return int(row[0])
+        return super().count
+
+
+class AutocompleteFilter(admin.RelatedFieldListFilter):
+    """Фильтр по связанной модели с полем автодополнения вместо
+    списка всех объектов в боковой панели."""
+
+    template = 'admin/autocomplete_filter.html'
+
+    def field_choices(self, field, request, model_admin):
+        # Варианты подгружает автодополнение, список не нужен.
+        return []
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        yield {
+            'query_string': changelist.get_query_string(
+                remove=[self.lookup_kwarg, self.lookup_kwarg_isnull]),
+        }
+
+    def rendered_widget(self):
+        form_field = forms.ModelChoiceField(
+            queryset=self.field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(self.field, admin.site),
+            required=False)
+        value = self.lookup_val[-1] if self.lookup_val else None
+        return form_field.widget.render(
+            self.lookup_kwarg, value,
+            attrs={'id': f'id_{self.lookup_kwarg}', 'style': 'width: 100%'})
+
+
+class AutocompleteFilterMixin:
+    """Подключает к списку статику виджета автодополнения."""
+
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(
+            Recipe._meta.get_field('author'), admin.site).media
+
+
+class CollectionAdmin(admin.ModelAdmin):
+    """Общий список избранного и корзин: несколько первых рецептов
+    и их общее число без запросов на каждую строку."""
+
+    list_display = ('user', 'list_recipes')
+    list_select_related = ('user',)
+    search_fields = ['user__username', '^recipes__name']
+    autocomplete_fields = ('user', 'recipes')
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            recipes_count=Count('recipes', distinct=True)
+        ).prefetch_related(Prefetch(
+            'recipes',
+            queryset=Recipe.objects.only('name').order_by('id')
+            [:LIST_RECIPES_LIMIT],
+            to_attr='first_recipes'))
+
+    def list_recipes(self, obj):
+        recipe_names = ", ".join(
+            recipe.name for recipe in obj.first_recipes)
+        if obj.recipes_count > LIST_RECIPES_LIMIT:
+            recipe_names += f' … (всего {obj.recipes_count})'
+        return recipe_names
+
+    list_recipes.short_description = 'Recipes'
+
 
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
     extra = 1
+    autocomplete_fields = ('ingredient',)
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     inlines = [RecipeIngredientInline, ]
     list_display = ('name', 'author_name', 'cooking_time', 'favorites_count')
-    search_fields = ['name', 'text', 'author__username']
-    list_filter = ('tags', 'author')
+    list_select_related = ('author',)
+    search_fields = ['^name', '^author__username']
+    list_filter = ('tags', ('author', AutocompleteFilter))
+    autocomplete_fields = ('author',)
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    def get_search_results(self, request, queryset, search_term):
+        """К поиску по началу названия и имени автора добавляет поиск
+        по тексту рецепта: в PostgreSQL полнотекстовый, по индексу
+        recipes_recipe_text_search."""
+        if not search_term:
+            return super().get_search_results(request, queryset,
+                                              search_term)
+        if connection.vendor == 'postgresql':
+            text_matches = queryset.filter(RawSQL(
+                f"to_tsvector('russian', {Recipe._meta.db_table}.text) "
+                "@@ plainto_tsquery('russian', %s)", (search_term,),
+                output_field=BooleanField()))
+        else:
+            text_matches = queryset.filter(text__icontains=search_term)
+        queryset, may_have_duplicates = super().get_search_results(
+            request, queryset, search_term)
+        return queryset | text_matches, may_have_duplicates
+
+    def get_queryset(self, request):
+        favorites = Favorite.recipes.through.objects.filter(
+            recipe_id=OuterRef('pk')).values('recipe_id').annotate(
+            total=Count('*')).values('total')
+        return super().get_queryset(request).annotate(
+            favorites_count=Coalesce(Subquery(favorites), 0))
 
     def author_name(self, obj):
         return obj.author.first_name + ' ' + obj.author.last_name
     author_name.short_description = 'Имя и фамилия автора'
 
     def favorites_count(self, obj):
-        return Favorite.objects.filter(recipes=obj).count()
+        return obj.favorites_count
     favorites_count.short_description = 'Добавлений в избранное'
+    favorites_count.admin_order_field = 'favorites_count'
 
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
-    list_display = ('name', 'measurement_unit')
-    search_fields = ['name']
+    list_display = ('name', 'measurement_unit', 'calories', 'proteins',
+                    'fats', 'carbohydrates')
+    search_fields = ['^name']
+    show_full_result_count = False
 
 
 @admin.register(Tag)
@@ -37,36 +171,29 @@ class TagAdmin(admin.ModelAdmin):
 
 
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
-    list_display = ('user', 'list_recipes')
-    search_fields = ['user__username', 'recipe__name']
-
-    def list_recipes(self, obj):
-        recipe_names = obj.recipes.values_list('name', flat=True)
-        return ", ".join(recipe_names)
-
-    list_recipes.short_description = 'Recipes'
+class FavoriteAdmin(CollectionAdmin):
+    pass
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
-    list_display = ('user', 'list_recipes')
-    search_fields = ['user__username', 'recipe__name']
-
-    def list_recipes(self, obj):
-        recipe_names = obj.recipes.values_list('name', flat=True)
-        return ", ".join(recipe_names)
-
-    list_recipes.short_description = 'Recipes'
+class ShoppingCartAdmin(CollectionAdmin):
+    pass
 
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ('user', 'list_subscriptions')
-    search_fields = ['user__username', 'subscription__username']
+    list_select_related = ('user',)
+    search_fields = ['user__username', '^subscription__username']
+    autocomplete_fields = ('user', 'subscription')
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(Prefetch(
+            'subscription', queryset=User.objects.only('username')))
 
     def list_subscriptions(self, obj):
-        usernames = obj.subscription.values_list('username', flat=True)
+        usernames = [user.username for user in obj.subscription.all()]
         return ", ".join(usernames)
 
     list_subscriptions.short_description = 'Subscriptions'
@@ -1,29 +1,184 @@
-from django.core.management.base import BaseCommand
-from rest_framework.utils import json
+import csv
+import io
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
 from foodgram.settings import BASE_DIR
-from recipes.models import Ingredient, Tag
+from recipes.models import Ingredient, Recipe, Tag
+
+INGREDIENT_FIELDS = ('name', 'measurement_unit')
+NUTRITION_FIELDS = ('calories', 'proteins', 'fats', 'carbohydrates')
+JSON_READ_SIZE = 64 * 1024
+
+
+def iter_csv(path):
+    with open(path, 'r', encoding='utf8', newline='') as file:
+        for row in csv.reader(file):
+            if row:
+                yield dict(zip(INGREDIENT_FIELDS, row))
+
+
+def iter_json(path):
+    """Читает массив объектов из JSON по частям, не загружая весь файл."""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf8') as file:
+        buffer = file.read(JSON_READ_SIZE).lstrip()
+        if not buffer.startswith('['):
+            raise CommandError('Ожидался JSON-массив ингредиентов.')
+        buffer = buffer[1:]
+        eof = False
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise CommandError('Некорректный JSON-файл.')
+                chunk = file.read(JSON_READ_SIZE)
+                eof = not chunk
+                buffer += chunk
+                continue
+            yield item
+            buffer = buffer[end:]
+
+
+READERS = {
+    'csv': iter_csv,
+    'json': iter_json,
+}
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
 
 
 class Command(BaseCommand):
-    def handle(self, *args, **kwargs):
-        self.load_ingredients()
+    help = ('Загружает ингредиенты (идемпотентно, пачками) '
+            'и создаёт базовые теги.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=str(BASE_DIR.joinpath('data', 'ingredients.json')),
+            help='Путь к файлу с ингредиентами (.json или .csv).')
+        parser.add_argument(
+            '--format', choices=READERS.keys(), default=None,
+            help='Формат файла; по умолчанию определяется по расширению.')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Размер пачки для вставки.')
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='Загружать через COPY (только PostgreSQL).')
+        parser.add_argument(
+            '--nutrition-path',
+            default=str(BASE_DIR.joinpath('data',
+                                          'ingredients_nutrition.csv')),
+            help='CSV с пищевой ценностью ингредиентов на 100 единиц '
+                 'измерения; загружается, если файл есть.')
+        parser.add_argument(
+            '--skip-if-loaded', action='store_true',
+            help='Ничего не делать, если ингредиенты, теги и пищевая '
+                 'ценность уже есть.')
+
+    def handle(self, *args, **options):
+        nutrition = Path(options['nutrition_path'])
+        if (options['skip_if_loaded']
+                and Ingredient.objects.exists() and Tag.objects.exists()
+                and (not nutrition.exists() or Ingredient.objects.filter(
+                    calories__isnull=False).exists())):
+            return
+        self.load_ingredients(**options)
         self.create_tags()
+        if nutrition.exists():
+            self.load_nutrition(nutrition, options['batch_size'])
+
+    def load_ingredients(self, path, format=None, batch_size=5000,
+                         copy=False, **kwargs):
+        file_format = format or path.rsplit('.', 1)[-1].lower()
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {file_format}.')
+        if copy and connection.vendor != 'postgresql':
+            raise CommandError('COPY поддерживается только в PostgreSQL.')
+
+        write_batch = self.copy_batch if copy else self.insert_batch
+        started = time.monotonic()
+        total = 0
+        for batch in chunked(READERS[file_format](path), batch_size):
+            with transaction.atomic():
+                write_batch(batch)
+            total += len(batch)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'Обработано ингредиентов: {total} '
+                f'({total / elapsed if elapsed else 0:.0f} строк/с)')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Ингредиенты загружены: {total} строк за '
+            f'{time.monotonic() - started:.2f} с.'))
+
+    def insert_batch(self, batch):
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=item['name'],
+                        measurement_unit=item['measurement_unit'])
+             for item in batch],
+            ignore_conflicts=True,
+        )
 
-    def load_ingredients(self):
-        if not Ingredient.objects.all().exists():
-            path = BASE_DIR.joinpath('data', 'ingredients.json')
+    def copy_batch(self, batch):
+        table = Ingredient._meta.db_table
+        columns = ', '.join(INGREDIENT_FIELDS)
+        data = io.StringIO()
+        writer = csv.writer(data)
+        for item in batch:
+            writer.writerow([item[field] for field in INGREDIENT_FIELDS])
 
-            with open(path, 'r', encoding='utf8') as file:
-                data = json.load(file)
-                ingredients = []
-                for ingredient in data:
-                    ingredients.append(Ingredient(
-                        name=ingredient['name'],
-                        measurement_unit=ingredient['measurement_unit']
-                    ))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_import '
+                '(name varchar(256), measurement_unit varchar(256)) '
+                'ON COMMIT DROP')
+            with cursor.cursor.copy(
+                    f'COPY ingredient_import ({columns}) FROM STDIN '
+                    'WITH CSV') as copy:
+                copy.write(data.getvalue())
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT DISTINCT {columns} FROM ingredient_import '
+                f'ON CONFLICT ({columns}) DO NOTHING')
 
-                Ingredient.objects.bulk_create(ingredients)
+    def load_nutrition(self, path, batch_size):
+        """Дополняет ингредиенты пищевой ценностью: новые создаются,
+        у существующих обновляются только поля пищевой ценности."""
+        total = 0
+        with open(path, 'r', encoding='utf8', newline='') as file:
+            for batch in chunked(csv.DictReader(file), batch_size):
+                Ingredient.objects.bulk_create(
+                    [Ingredient(**{field: item[field]
+                                   for field in INGREDIENT_FIELDS},
+                                **{field: float(item[field])
+                                   if item[field] else None
+                                   for field in NUTRITION_FIELDS})
+                     for item in batch],
+                    update_conflicts=True,
+                    unique_fields=INGREDIENT_FIELDS,
+                    update_fields=NUTRITION_FIELDS,
+                )
+                total += len(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пищевая ценность загружена: {total} ингредиентов.'))
+        if Recipe.objects.exists():
+            call_command('recompute_nutrition', stdout=self.stdout)
 
     def create_tags(self):
         if not Tag.objects.all().exists():
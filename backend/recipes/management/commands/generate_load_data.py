@@ -0,0 +1,242 @@
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from api.cache import AnonymousResponseCache
+from api.changelog import ChangeLog
+from api.nutrition import NutritionCalculator
+from api.similarity import MinHashIndex, NearDuplicates
+from recipes.models import (ChangeLogEntry, Favorite, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, Subscription,
+                            Tag)
+
+USERNAME_PREFIX = 'load_user_'
+WORDS = ('суп', 'салат', 'пирог', 'рагу', 'паста', 'каша', 'омлет',
+         'запеканка', 'плов', 'борщ', 'котлеты', 'блины', 'гуляш')
+ADJECTIVES = ('домашний', 'быстрый', 'острый', 'летний', 'сытный',
+              'овощной', 'бабушкин', 'праздничный', 'лёгкий', 'пряный')
+
+
+def zipf_weights(size, exponent):
+    """Накопленные веса распределения Ципфа для random.choices."""
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, size + 1)))
+
+
+def pick_distinct(rng, population, cum_weights, count):
+    """Выбирает до count разных элементов с учётом популярности."""
+    chosen = set(rng.choices(population, cum_weights=cum_weights,
+                             k=count * 2))
+    return list(chosen)[:count]
+
+
+def generate_recipes(task):
+    (worker, start, count, user_ids, ingredient_ids, tag_ids,
+     options) = task
+    connections.close_all()
+    rng = random.Random(options['seed'] + worker)
+    author_weights = zipf_weights(len(user_ids), options['zipf'])
+    ingredient_weights = zipf_weights(len(ingredient_ids), options['zipf'])
+    tag_through = Recipe.tags.through
+    batch_size = options['batch_size']
+    matrix = NutritionCalculator.matrix()
+
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        authors = rng.choices(user_ids, cum_weights=author_weights, k=size)
+        recipes, recipe_ingredients = [], []
+        for index, author in enumerate(authors):
+            name = (f'{rng.choice(WORDS).capitalize()} '
+                    f'{rng.choice(ADJECTIVES)} '
+                    f'№{start + created + index}')
+            amount = max(1, int(rng.gauss(options['ingredients'], 3)))
+            ingredients = pick_distinct(rng, ingredient_ids,
+                                        ingredient_weights, amount)
+            recipe_ingredients.append([
+                RecipeIngredient(ingredient_id=ingredient,
+                                 amount=rng.randint(1, 500))
+                for ingredient in ingredients])
+            recipes.append(Recipe(
+                author_id=author, name=name,
+                text='Описание рецепта для нагрузочного тестирования.',
+                cooking_time=max(1, int(rng.lognormvariate(3.3, 0.6))),
+                duplicate_signature=NearDuplicates.signature(name,
+                                                             ingredients)))
+        with transaction.atomic():
+            recipes = Recipe.objects.bulk_create(recipes)
+            recipe_tags = []
+            for recipe, ingredients in zip(recipes, recipe_ingredients):
+                for ingredient in ingredients:
+                    ingredient.recipe_id = recipe.id
+                for tag in rng.sample(tag_ids,
+                                      rng.randint(1, len(tag_ids))):
+                    recipe_tags.append(tag_through(recipe_id=recipe.id,
+                                                   tag_id=tag))
+            recipe_ingredients = [ingredient for ingredients
+                                  in recipe_ingredients
+                                  for ingredient in ingredients]
+            RecipeIngredient.objects.bulk_create(recipe_ingredients,
+                                                 batch_size=batch_size)
+            tag_through.objects.bulk_create(recipe_tags,
+                                            batch_size=batch_size)
+            # bulk_create не отправляет сигналы: пищевая ценность, полосы
+            # LSH и журнал синхронизации заполняются здесь же.
+            recipe_ids = [recipe.id for recipe in recipes]
+            pairs = [(ingredient.recipe_id, ingredient.ingredient_id,
+                      ingredient.amount)
+                     for ingredient in recipe_ingredients]
+            NutritionCalculator.save(recipe_ids, NutritionCalculator.
+                                     recipe_totals(matrix, recipe_ids, pairs))
+            MinHashIndex.index(recipe_ids, [pair[:2] for pair in pairs])
+            ChangeLog.record(ChangeLogEntry.RECIPE, recipe_ids)
+        created += size
+    return created
+
+
+def generate_relations(task):
+    worker, user_ids, recipe_ids, author_ids, options = task
+    connections.close_all()
+    rng = random.Random(options['seed'] + 1000 + worker)
+    recipe_weights = zipf_weights(len(recipe_ids), options['zipf'])
+    author_weights = zipf_weights(len(author_ids), options['zipf'])
+    users_range = (min(user_ids), max(user_ids))
+    favorites, carts, subscriptions = (
+        dict(model.objects.filter(user__id__range=users_range)
+             .values_list('user_id', 'id'))
+        for model in (Favorite, ShoppingCart, Subscription))
+
+    favorite_rows, cart_rows, subscription_rows = [], [], []
+    journal = []
+    for user in user_ids:
+        recipes = pick_distinct(rng, recipe_ids, recipe_weights,
+                                rng.randint(0, options['favorites']))
+        favorite_rows += [Favorite.recipes.through(
+            favorite_id=favorites[user], recipe_id=recipe)
+            for recipe in recipes]
+        journal.append((ChangeLogEntry.FAVORITE, recipes, user))
+        recipes = pick_distinct(rng, recipe_ids, recipe_weights,
+                                rng.randint(0, options['cart']))
+        cart_rows += [ShoppingCart.recipes.through(
+            shoppingcart_id=carts[user], recipe_id=recipe)
+            for recipe in recipes]
+        journal.append((ChangeLogEntry.SHOPPING_CART, recipes, user))
+        authors = [author for author in pick_distinct(
+            rng, author_ids, author_weights,
+            rng.randint(0, options['subscriptions'])) if author != user]
+        subscription_rows += [Subscription.subscription.through(
+            subscription_id=subscriptions[user], user_id=author)
+            for author in authors]
+        journal.append((ChangeLogEntry.SUBSCRIPTION, authors, user))
+
+    batch_size = options['batch_size']
+    with transaction.atomic():
+        for rows in (favorite_rows, cart_rows, subscription_rows):
+            if rows:
+                type(rows[0]).objects.bulk_create(
+                    rows, batch_size=batch_size, ignore_conflicts=True)
+        for kind, object_ids, user in journal:
+            ChangeLog.record(kind, object_ids, user)
+    return len(favorite_rows) + len(cart_rows) + len(subscription_rows)
+
+
+def split(items, parts):
+    size = -(-len(items) // parts)
+    return [items[index:index + size]
+            for index in range(0, len(items), size)]
+
+
+class Command(BaseCommand):
+    help = ('Генерирует пользователей, рецепты, избранное, корзины '
+            'и подписки для нагрузочного тестирования.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--ingredients', type=int, default=10,
+                            help='Среднее число ингредиентов в рецепте.')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Максимум избранных рецептов у пользователя.')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Максимум рецептов в корзине пользователя.')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Максимум подписок у пользователя.')
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Показатель распределения популярности.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        for name in ('users', 'recipes', 'ingredients', 'batch_size',
+                     'workers'):
+            if options[name] < 1:
+                raise CommandError(
+                    f'--{name.replace("_", "-")} должно быть не меньше 1.')
+        for name in ('favorites', 'cart', 'subscriptions'):
+            if options[name] < 0:
+                raise CommandError(f'--{name} не может быть отрицательным.')
+        if not Ingredient.objects.exists() or not Tag.objects.exists():
+            raise CommandError('Сначала выполните команду fill_db.')
+        started = time.monotonic()
+
+        user_ids = self.create_users(options['users'], options['batch_size'])
+        self.report('Пользователи', len(user_ids), started)
+
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        workers = options['workers']
+        per_worker = -(-options['recipes'] // workers)
+        tasks = [
+            (worker, worker * per_worker,
+             min(per_worker, options['recipes'] - worker * per_worker),
+             user_ids, ingredient_ids, tag_ids, options)
+            for worker in range(workers)
+            if worker * per_worker < options['recipes']
+        ]
+        recipes = sum(self.run(generate_recipes, tasks, workers))
+        self.report('Рецепты', recipes, started)
+
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        tasks = [(worker, chunk, recipe_ids, user_ids, options)
+                 for worker, chunk in enumerate(split(user_ids, workers))]
+        relations = sum(self.run(generate_relations, tasks, workers))
+        self.report('Избранное, корзины и подписки', relations, started)
+        AnonymousResponseCache.invalidate_all()
+
+    def run(self, function, tasks, workers):
+        if workers == 1:
+            return [function(task) for task in tasks]
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(function, tasks))
+
+    def create_users(self, count, batch_size):
+        offset = User.objects.filter(
+            username__startswith=USERNAME_PREFIX).count()
+        password = make_password('load-password')
+        users = [
+            User(username=f'{USERNAME_PREFIX}{offset + index}',
+                 email=f'{USERNAME_PREFIX}{offset + index}@example.com',
+                 first_name='Нагрузка', last_name=str(offset + index),
+                 password=password)
+            for index in range(count)
+        ]
+        with transaction.atomic():
+            user_ids = [user.id for user in User.objects.bulk_create(
+                users, batch_size=batch_size)]
+            for model in (ShoppingCart, Favorite, Subscription):
+                model.objects.bulk_create(
+                    [model(user_id=user) for user in user_ids],
+                    batch_size=batch_size)
+        return user_ids
+
+    def report(self, title, count, started):
+        self.stdout.write(self.style.SUCCESS(
+            f'{title}: {count} за {time.monotonic() - started:.1f} с.'))
@@ -0,0 +1,23 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+MIGRATION_LOCK_ID = 732_001
+
+
+class Command(BaseCommand):
+    help = ('Применяет миграции под advisory-блокировкой PostgreSQL, '
+            'чтобы при старте нескольких реплик их выполняла только одна.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            call_command('migrate', interactive=False)
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', [MIGRATION_LOCK_ID])
+            try:
+                call_command('migrate', interactive=False)
+            finally:
+                cursor.execute('SELECT pg_advisory_unlock(%s)',
+                               [MIGRATION_LOCK_ID])
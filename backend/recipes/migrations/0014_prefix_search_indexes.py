@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# Поиск в админке по '^поле' строит UPPER(поле::text) LIKE 'X%',
+# такие запросы использует только индекс по выражению с
+# text_pattern_ops. Индексы нужны лишь PostgreSQL.
+PREFIX_INDEXES = (
+    ('recipes_recipe_name_upper_like', 'recipes_recipe', 'name'),
+    ('recipes_ingredient_name_upper_like', 'recipes_ingredient', 'name'),
+    ('auth_user_username_upper_like', 'auth_user', 'username'),
+)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in PREFIX_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+            f'(UPPER({column}::text) text_pattern_ops)')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in PREFIX_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('recipes', '0013_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-19 08:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_recipesimilarityband'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='duplicate_signature',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=32, verbose_name='Сигнатура для поиска дубликатов'),
+        ),
+    ]
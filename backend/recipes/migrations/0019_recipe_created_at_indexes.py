@@ -0,0 +1,68 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+# Фильтр ?tags= идёт от тега к рецептам; с индексом (tag_id, recipe_id)
+# id рецептов читаются из индекса промежуточной таблицы без обращения
+# к её строкам. Таблицу создаёт ManyToManyField, поэтому индекс
+# добавляется вручную.
+TAG_RECIPE_INDEX = 'recipes_recipe_tags_tag_recipe'
+
+
+def backfill_created_at(apps, schema_editor):
+    # Настоящая дата создания старых рецептов неизвестна, ближе всего
+    # к ней дата последнего изменения.
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.update(created_at=models.F('updated_at'))
+
+
+def create_tag_index(apps, schema_editor):
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {TAG_RECIPE_INDEX} '
+        f'ON recipes_recipe_tags (tag_id, recipe_id)')
+
+
+def drop_tag_index(apps, schema_editor):
+    schema_editor.execute(f'DROP INDEX IF EXISTS {TAG_RECIPE_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('recipes', '0018_changelogentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата создания'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['cooking_time', 'id'], name='recipe_cooking_time'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['created_at', 'id'], name='recipe_created_at'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['name', 'id'], name='recipe_name'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', 'cooking_time', 'id'], name='recipe_author_cooking_time'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', 'created_at', 'id'], name='recipe_author_created_at'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', 'name', 'id'], name='recipe_author_name'),
+        ),
+        migrations.RunPython(create_tag_index, drop_tag_index),
+    ]
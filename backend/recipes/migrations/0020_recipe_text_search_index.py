@@ -0,0 +1,29 @@
+from django.db import migrations
+
+# Полнотекстовый поиск по тексту рецепта в админке
+# (RecipeAdmin.get_search_results); индекс нужен лишь PostgreSQL.
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipes_recipe_text_search '
+        "ON recipes_recipe USING gin (to_tsvector('russian', text))")
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipes_recipe_text_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_recipe_created_at_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -21,10 +21,23 @@ class Ingredient(models.Model):
     name = models.CharField(max_length=256, verbose_name='Имя')
     measurement_unit = models.CharField(max_length=256,
                                         verbose_name='Единица измерения')
+    # Пищевая ценность на 100 единиц измерения (100 г, 100 мл);
+    # пусто, если данных нет.
+    calories = models.FloatField(null=True, blank=True,
+                                 verbose_name='Калории, ккал')
+    proteins = models.FloatField(null=True, blank=True,
+                                 verbose_name='Белки, г')
+    fats = models.FloatField(null=True, blank=True, verbose_name='Жиры, г')
+    carbohydrates = models.FloatField(null=True, blank=True,
+                                      verbose_name='Углеводы, г')
 
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            UniqueConstraint(fields=['name', 'measurement_unit'],
+                             name='unique_ingredient')
+        ]
 
     def __str__(self):
         return self.name
@@ -74,15 +87,66 @@ class Recipe(models.Model):
     cooking_time = models.IntegerField(default=0,
                                        verbose_name='Время приготовления',
                                        validators=[MinValueValidator(0)])
+    created_at = models.DateTimeField(auto_now_add=True,
+                                      verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True,
+                                      verbose_name='Дата изменения')
+    # Пищевая ценность рецепта; пусто, если данных нет хотя бы для
+    # одного ингредиента. Пересчитывается NutritionCalculator.
+    calories = models.FloatField(null=True, db_index=True, editable=False,
+                                 verbose_name='Калории, ккал')
+    proteins = models.FloatField(null=True, editable=False,
+                                 verbose_name='Белки, г')
+    fats = models.FloatField(null=True, editable=False,
+                             verbose_name='Жиры, г')
+    carbohydrates = models.FloatField(null=True, editable=False,
+                                      verbose_name='Углеводы, г')
+    duplicate_signature = models.CharField(
+        max_length=32, blank=True, db_index=True, editable=False,
+        verbose_name='Сигнатура для поиска дубликатов')
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        # Индексы под фильтры и сортировки списка рецептов: id замыкает
+        # порядок страницы, префикс author — для ?author=.
+        indexes = [
+            models.Index(fields=['cooking_time', 'id'],
+                         name='recipe_cooking_time'),
+            models.Index(fields=['created_at', 'id'],
+                         name='recipe_created_at'),
+            models.Index(fields=['name', 'id'], name='recipe_name'),
+            models.Index(fields=['author', 'cooking_time', 'id'],
+                         name='recipe_author_cooking_time'),
+            models.Index(fields=['author', 'created_at', 'id'],
+                         name='recipe_author_created_at'),
+            models.Index(fields=['author', 'name', 'id'],
+                         name='recipe_author_name'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeSimilarityBand(models.Model):
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name='similarity_bands',
+                               verbose_name='Рецепт')
+    band = models.PositiveSmallIntegerField(verbose_name='Полоса')
+    bucket = models.BigIntegerField(verbose_name='Корзина LSH')
+
+    class Meta:
+        verbose_name = 'Полоса MinHash рецепта'
+        verbose_name_plural = 'Полосы MinHash рецептов'
+        indexes = [
+            models.Index(fields=['band', 'bucket'],
+                         name='similarity_band_bucket')
+        ]
+
+    def __str__(self):
+        return f"Recipe: {self.recipe_id} Band: {self.band}"
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              related_name='favorites',
@@ -129,3 +193,56 @@ class Subscription(models.Model):
 
     def __str__(self):
         return self.user.username
+
+
+class ChangeLogEntry(models.Model):
+    """Запись журнала изменений для синхронизации клиентов.
+
+    Записи только добавляются; id служит курсором синхронизации.
+    Записи без пользователя видны всем, с пользователем — только ему.
+    """
+
+    RECIPE = 'recipe'
+    FAVORITE = 'favorite'
+    SHOPPING_CART = 'shopping_cart'
+    SUBSCRIPTION = 'subscription'
+    # Изменения справочников: рецепты с тегом или ингредиентом в журнал
+    # не попадают, клиент обновляет их сам.
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    # Метка сжатия: удалены записи об удалении с id до object_id.
+    RESET = 'reset'
+    KINDS = (
+        (RECIPE, 'Рецепт'),
+        (FAVORITE, 'Избранное'),
+        (SHOPPING_CART, 'Корзина'),
+        (SUBSCRIPTION, 'Подписка'),
+        (TAG, 'Тег'),
+        (INGREDIENT, 'Ингредиент'),
+        (RESET, 'Сжатие журнала'),
+    )
+
+    kind = models.CharField(max_length=16, choices=KINDS,
+                            verbose_name='Тип')
+    object_id = models.BigIntegerField(verbose_name='Id объекта')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True,
+                             blank=True, related_name='change_log',
+                             verbose_name='Пользователь')
+    deleted = models.BooleanField(default=False, verbose_name='Удалён')
+    created_at = models.DateTimeField(auto_now_add=True,
+                                      verbose_name='Дата изменения')
+
+    class Meta:
+        verbose_name = 'Запись журнала изменений'
+        verbose_name_plural = 'Журнал изменений'
+        indexes = [
+            models.Index(fields=['user', 'id'], name='change_log_user'),
+            models.Index(fields=['kind', 'object_id'],
+                         name='change_log_object'),
+            models.Index(fields=['kind', 'deleted', 'id'],
+                         name='change_log_deleted'),
+            models.Index(fields=['created_at'], name='change_log_created'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"